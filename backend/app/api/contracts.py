@@ -21,6 +21,7 @@ from app.services.contract_parser import contract_parser
 from app.services.blockchain_service import blockchain_service
 from app.services.version_service import version_service  # V2: F3機能
 from app.services.audit_service import audit_service
+from app.services.obligation_service import obligation_service
 from app.services.rag_service import rag_service
 from app.api.auth import get_current_user_id
 
@@ -316,6 +317,16 @@ async def activate_contract(
     # データベースをコミット
     await db.commit()
     
+    # 契約開始: トリガー条件（「契約開始日から30日」等）の義務の期限日を確定
+    # （アクティベート自体は完了しているため、失敗してもログのみ）
+    try:
+        await obligation_service.update_obligation_status_from_blockchain(
+            db, contract_id, "contract_signed"
+        )
+    except Exception as e:
+        print(f"⚠️ 義務の期限日確定に失敗: {contract_id}: {str(e)}")
+        await db.rollback()
+    
     return {
         "message": "コントラクトのアクティベート完了",
         "tx_hash": tx_result["tx_hash"],
@@ -13,15 +13,23 @@ import logging
 from app.core.database import get_db
 from app.core.logging_config import get_logger
 from app.services.obligation_service import obligation_service
-from app.models.models import Obligation, ObligationType, PartyType, RiskLevel, ObligationStatus, Contract
+from app.models.models import Obligation, ObligationType, PartyType, RiskLevel, ObligationStatus, Contract, WorkspaceUser, WorkspaceUserStatus
 from sqlalchemy import select
 from app.core.x402 import PaymentVerifier
+from app.api.auth import get_current_user_id
 import os
 
 # ルーター初期化
 router = APIRouter(prefix="/obligations", tags=["obligations"])
 logger = get_logger(__name__)
 
+# 義務抽出の料金（1契約あたり、JPYC）
+EXTRACT_PRICE_PER_CONTRACT = 100.0
+# 並行抽出で1リクエストに指定できる契約数の上限（OpenAIへの同時呼び出しの膨張を防ぐ）
+EXTRACT_MANY_MAX_CONTRACTS = 10
+# Batch APIでの一括抽出で1リクエストに指定できる契約数の上限
+EXTRACT_BULK_MAX_CONTRACTS = 200
+
 
 # ===== Pydanticスキーマ定義 =====
 
@@ -106,6 +114,71 @@ class ObligationExtractRequest(BaseModel):
     contract_text: Optional[str] = Field(None, description="契約書の全文テキスト（省略時は保存されたファイルから読み込み）")
 
 
+class ObligationManyExtractRequest(BaseModel):
+    """複数契約の並行義務抽出リクエスト"""
+    contract_ids: List[str] = Field(..., min_length=1, max_length=EXTRACT_MANY_MAX_CONTRACTS, description="契約IDのリスト")
+
+
+class ObligationBulkExtractRequest(BaseModel):
+    """一括義務抽出リクエスト（Batch API経由）"""
+    contract_ids: List[str] = Field(..., min_length=1, max_length=EXTRACT_BULK_MAX_CONTRACTS, description="契約IDのリスト")
+
+
+class ObligationBulkExtractResponse(BaseModel):
+    """一括義務抽出レスポンス"""
+    batch_id: str
+    contract_count: int
+
+
+class ObligationBatchCollectResponse(BaseModel):
+    """一括義務抽出の取り込みレスポンス"""
+    batch_id: str
+    status: str = Field(..., description="OpenAIバッチの状態（completed以外は未完了または失敗）")
+    saved_contract_count: int = Field(..., description="今回義務を保存した契約数")
+
+
+# ===== ヘルパー関数 =====
+
+async def _load_contract_text(db: AsyncSession, contract_id: str) -> str:
+    """保存された契約書ファイルからテキストを抽出"""
+    # 契約情報を取得
+    result = await db.execute(select(Contract).where(Contract.id == contract_id))
+    contract = result.scalar_one_or_none()
+    
+    if not contract:
+        raise HTTPException(status_code=404, detail="契約が見つかりません")
+        
+    if not contract.file_url:
+        raise HTTPException(status_code=400, detail="契約書ファイルが見つかりません")
+        
+    # ファイルを読み込む
+    file_path = contract.file_url
+    
+    # 先頭の/がある場合は削除（環境によるパス解釈の違いを吸収）
+    if file_path.startswith('/uploads/'):
+        file_path = file_path[1:]
+        
+    if not os.path.exists(file_path):
+        # uploadsディレクトリ内を探す（後方互換性）
+        alt_path = os.path.join("uploads", os.path.basename(file_path))
+        if os.path.exists(alt_path):
+            file_path = alt_path
+        else:
+            raise HTTPException(status_code=400, detail=f"契約書ファイルが見つかりません: {file_path}")
+
+    try:
+        with open(file_path, "rb") as f:
+            file_content = f.read()
+        
+        # ファイル形式に応じてテキスト抽出
+        from app.services.contract_parser import contract_parser
+        # ファイル名を取得（パスから）
+        filename = os.path.basename(file_path)
+        return await contract_parser.extract_text_from_file(file_content, filename)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"ファイル読み込みエラー: {str(e)}")
+
+
 # ===== APIエンドポイント =====
 
 @router.post("/extract", response_model=List[ObligationResponse])
@@ -125,42 +198,7 @@ async def extract_obligations(
         # テキストが提供されていない場合はファイルから読み込む
         text_to_analyze = request.contract_text
         if not text_to_analyze:
-            # 契約情報を取得
-            result = await db.execute(select(Contract).where(Contract.id == request.contract_id))
-            contract = result.scalar_one_or_none()
-            
-            if not contract:
-                raise HTTPException(status_code=404, detail="契約が見つかりません")
-                
-            if not contract.file_url:
-                raise HTTPException(status_code=400, detail="契約書ファイルが見つかりません")
-                
-            # ファイルを読み込む
-            file_path = contract.file_url
-            
-            # 先頭の/がある場合は削除（環境によるパス解釈の違いを吸収）
-            if file_path.startswith('/uploads/'):
-                file_path = file_path[1:]
-                
-            if not os.path.exists(file_path):
-                 # uploadsディレクトリ内を探す（後方互換性）
-                 alt_path = os.path.join("uploads", os.path.basename(file_path))
-                 if os.path.exists(alt_path):
-                     file_path = alt_path
-                 else:
-                    raise HTTPException(status_code=400, detail=f"契約書ファイルが見つかりません: {file_path}")
-
-            try:
-                with open(file_path, "rb") as f:
-                    file_content = f.read()
-                
-                # ファイル形式に応じてテキスト抽出
-                from app.services.contract_parser import contract_parser
-                # ファイル名を取得（パスから）
-                filename = os.path.basename(file_path)
-                text_to_analyze = await contract_parser.extract_text_from_file(file_content, filename)
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"ファイル読み込みエラー: {str(e)}")
+            text_to_analyze = await _load_contract_text(db, request.contract_id)
 
         # AIで義務を抽出
         logger.info(f"🤖 契約書から義務を抽出: {request.contract_id}")
@@ -170,33 +208,12 @@ async def extract_obligations(
         )
         logger.info(f"✅ AI分析完了。抽出候補数: {len(extracted_obligations)}")
         
-        # 抽出された義務をデータベースに保存
-        created_obligations = []
-        import json
-        for i, ob_data in enumerate(extracted_obligations):
-            try:
-                logger.debug(f"💾 義務を保存: {i+1}/{len(extracted_obligations)}: {ob_data.get('title')}")
-                obligation = await obligation_service.create_obligation(
-                    db=db,
-                    contract_id=request.contract_id,
-                    title=ob_data.get("title"),
-                    type=ob_data.get("type"),
-                    due_date=None,  # 文字列の日付をパースする場合は別途実装
-                    trigger_condition=ob_data.get("trigger_condition"),
-                    responsible_party=ob_data.get("responsible_party"),
-                    action=ob_data.get("action"),
-                    evidence_required=ob_data.get("evidence_required", []),
-                    risk_level=ob_data.get("risk_level", "low"),
-                    confidence=ob_data.get("confidence"),
-                    clause_reference=ob_data.get("clause_reference")
-                )
-                created_obligations.append(obligation)
-            except Exception as e:
-                logger.error(f"❌ 義務保存失敗: {i+1}: {str(e)}", exc_info=True)
-                # 個別保存のエラーは続行する
-                continue
-                
-            created_obligations.append(obligation)
+        # 抽出された義務をデータベースに一括保存
+        created_obligations = await obligation_service.create_obligations_bulk(
+            db=db,
+            contract_id=request.contract_id,
+            obligation_dicts=extracted_obligations
+        )
 
         logger.info(f"✅ {len(created_obligations)} 義務をDBに保存しました")
         return created_obligations
@@ -211,6 +228,136 @@ async def extract_obligations(
         )
 
 
+@router.post("/extract/many", response_model=List[ObligationResponse])
+async def extract_obligations_many(
+    request: ObligationManyExtractRequest,
+    db: AsyncSession = Depends(get_db),
+    # F8: x402 Paywall (1契約あたり100 JPYC)
+    payment_verified: bool = Depends(PaymentVerifier(amount=EXTRACT_PRICE_PER_CONTRACT, per_item_field="contract_ids"))
+):
+    """
+    複数契約書から義務を並行抽出（即時）
+    
+    各契約のAI抽出を並行実行し、結果をまとめて返す。
+    数時間待てる大量取り込みには /extract/bulk（Batch API）を使用する。
+    """
+    try:
+        # 同一セッションは並行利用できないため、テキストの読み込みは順に行う
+        contracts = []
+        for contract_id in request.contract_ids:
+            contracts.append((contract_id, await _load_contract_text(db, contract_id)))
+        
+        logger.info(f"🤖 {len(contracts)} 件の契約書から義務を並行抽出")
+        results = await obligation_service.extract_many(contracts)
+        
+        created_obligations = []
+        for (contract_id, _), extracted_obligations in zip(contracts, results):
+            created_obligations.extend(await obligation_service.create_obligations_bulk(
+                db=db,
+                contract_id=contract_id,
+                obligation_dicts=extracted_obligations
+            ))
+        
+        logger.info(f"✅ {len(created_obligations)} 義務をDBに保存しました")
+        return created_obligations
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"義務抽出エラー: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"義務抽出エラー: {str(e)}"
+        )
+
+
+@router.post("/extract/bulk", response_model=ObligationBulkExtractResponse, status_code=status.HTTP_202_ACCEPTED)
+async def extract_obligations_bulk(
+    request: ObligationBulkExtractRequest,
+    db: AsyncSession = Depends(get_db),
+    # F8: x402 Paywall (1契約あたり100 JPYC)
+    payment_verified: bool = Depends(PaymentVerifier(amount=EXTRACT_PRICE_PER_CONTRACT, per_item_field="contract_ids"))
+):
+    """
+    複数契約書から義務を一括抽出
+    
+    OpenAI Batch APIに投入して即座に返す。抽出結果はバッチ完了後（最大24時間）に
+    バックグラウンドでデータベースへ保存される。大量取り込み・再インデックス向け。
+    バッチIDは契約に保存され、サーバー再起動後も取り込みが再開される。
+    """
+    try:
+        contracts = []
+        for contract_id in request.contract_ids:
+            contracts.append((contract_id, await _load_contract_text(db, contract_id)))
+        
+        batch_id = await obligation_service.submit_extraction_batch(db, contracts)
+        obligation_service.start_batch_ingestion(batch_id)
+        
+        logger.info(f"📦 義務の一括抽出を受け付けました: {batch_id} ({len(contracts)} contracts)")
+        return ObligationBulkExtractResponse(batch_id=batch_id, contract_count=len(contracts))
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"一括義務抽出エラー: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"一括義務抽出エラー: {str(e)}"
+        )
+
+
+@router.post("/extract/bulk/{batch_id}/collect", response_model=ObligationBatchCollectResponse)
+async def collect_obligations_bulk(
+    batch_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user_id: str = Depends(get_current_user_id)
+):
+    """
+    一括義務抽出のバッチ状態を確認し、完了していれば結果を取り込む
+    
+    バックグラウンドの取り込みを待たずに結果を反映したい場合に使用する。
+    取り込み待ちの契約がすべて呼び出し元の所属ワークスペースのものである場合のみ実行できる。
+    取り込み済みの契約は再度保存されない。
+    """
+    # バッチの取り込み待ちの契約と、呼び出し元が所属するワークスペースを照合
+    result = await db.execute(
+        select(Contract.workspace_id).where(Contract.obligation_batch_id == batch_id)
+    )
+    workspace_ids = set(result.scalars().all())
+    if not workspace_ids:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"取り込み待ちのバッチが見つかりません: {batch_id}"
+        )
+    
+    member_result = await db.execute(
+        select(WorkspaceUser.workspace_id).where(
+            WorkspaceUser.user_id == current_user_id,
+            WorkspaceUser.status == WorkspaceUserStatus.ACTIVE
+        )
+    )
+    if not workspace_ids <= set(member_result.scalars().all()):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="このバッチの契約にアクセスする権限がありません"
+        )
+    
+    try:
+        batch_status, saved = await obligation_service.collect_extraction_batch(batch_id)
+        logger.info(f"📦 義務抽出バッチの取り込み: {batch_id} ({batch_status}, {saved} contracts)")
+        return ObligationBatchCollectResponse(
+            batch_id=batch_id,
+            status=batch_status,
+            saved_contract_count=saved
+        )
+    except Exception as e:
+        logger.error(f"一括義務抽出の取り込みエラー: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"一括義務抽出の取り込みエラー: {str(e)}"
+        )
+
+
 @router.post("/", response_model=ObligationResponse, status_code=status.HTTP_201_CREATED)
 async def create_obligation(
     obligation_data: ObligationCreate,
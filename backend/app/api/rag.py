@@ -3,6 +3,7 @@ LexFlow Protocol - RAG API Routes
 契約書横断検索およびAI問合せ用エンドポイント
 """
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
 
@@ -102,3 +103,24 @@ async def chat_with_contracts(
     except Exception as e:
         print(f"❌ RAG チャットエラー: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chat/stream")
+async def chat_with_contracts_stream(
+    chat_query: ChatQuery,
+    current_user_id: str = Depends(get_current_user_id)
+):
+    """
+    契約書の内容に基づくAI回答をServer-Sent Eventsでストリーミング
+    
+    回答トークンを "data:" フレームで逐次送信し、
+    最後に引用元のリストを "event: sources" フレームで送信します。
+    """
+    return StreamingResponse(
+        rag_service.stream_query_with_context(
+            workspace_id=chat_query.workspace_id,
+            query=chat_query.query,
+            limit=chat_query.limit
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -4,6 +4,7 @@ LexFlow Protocol - Redline API
 """
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, Field
 from datetime import datetime
@@ -15,6 +16,9 @@ from app.services.version_service import version_service
 
 router = APIRouter(prefix="/redline", tags=["redline"])
 
+# 一括比較で1リクエストに指定できる組の上限
+REDLINE_BATCH_MAX_PAIRS = 20
+
 
 class RedlineCompareRequest(BaseModel):
     """差分比較リクエスト"""
@@ -22,6 +26,11 @@ class RedlineCompareRequest(BaseModel):
     new_version_id: str = Field(description="比較先バージョンID")
 
 
+class RedlineBatchCompareRequest(BaseModel):
+    """複数組の差分比較リクエスト"""
+    pairs: List[RedlineCompareRequest] = Field(min_length=1, max_length=REDLINE_BATCH_MAX_PAIRS, description="比較するバージョンの組")
+
+
 class ChangeItemResponse(BaseModel):
     """変更箇所レスポンス"""
     change_type: str
@@ -53,13 +62,12 @@ class RedlineCompareResponse(BaseModel):
     diff_html: str
 
 
-@router.post("/compare", response_model=RedlineCompareResponse)
-async def compare_versions(
-    request: RedlineCompareRequest,
-    db: AsyncSession = Depends(get_db)
-):
+async def _load_version_files(db: AsyncSession, request: RedlineCompareRequest):
     """
-    2つのバージョンを比較し、差分解析とAIリスク評価を返す
+    比較対象の2バージョンを検証し、バージョン情報とファイル内容を取得
+    
+    Returns:
+        (旧バージョン, 新バージョン, 旧ファイルパス, 新ファイルパス, 旧ファイル内容, 新ファイル内容)
     """
     # 1. バージョン情報の取得
     old_version = await version_service.get_version_by_id(db, request.old_version_id)
@@ -113,18 +121,11 @@ async def compare_versions(
     with open(new_file_path, "rb") as f:
         new_file_content = f.read()
     
-    # 5. 差分解析の実行
-    print(f"🔄 Comparing versions: {old_version.version} -> {new_version.version}")
-    result = await redline_service.compare_versions(
-        old_file_content=old_file_content,
-        new_file_content=new_file_content,
-        old_version_id=request.old_version_id,
-        new_version_id=request.new_version_id,
-        old_filename=os.path.basename(old_file_path),
-        new_filename=os.path.basename(new_file_path)
-    )
-    
-    # 6. レスポンスの構築
+    return old_version, new_version, old_file_path, new_file_path, old_file_content, new_file_content
+
+
+def _to_response(result: RedlineResult) -> RedlineCompareResponse:
+    """比較結果をレスポンスに変換"""
     return RedlineCompareResponse(
         old_version_id=result.old_version_id,
         new_version_id=result.new_version_id,
@@ -153,6 +154,85 @@ async def compare_versions(
     )
 
 
+@router.post("/compare", response_model=RedlineCompareResponse)
+async def compare_versions(
+    request: RedlineCompareRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    2つのバージョンを比較し、差分解析とAIリスク評価を返す
+    """
+    # 1〜4. バージョンの検証とファイルの読み込み
+    (
+        old_version, new_version,
+        old_file_path, new_file_path,
+        old_file_content, new_file_content
+    ) = await _load_version_files(db, request)
+    
+    # 5. 差分解析の実行
+    print(f"🔄 Comparing versions: {old_version.version} -> {new_version.version}")
+    result = await redline_service.compare_versions(
+        old_file_content=old_file_content,
+        new_file_content=new_file_content,
+        old_version_id=request.old_version_id,
+        new_version_id=request.new_version_id,
+        old_filename=os.path.basename(old_file_path),
+        new_filename=os.path.basename(new_file_path)
+    )
+    
+    # 6. レスポンスの構築
+    return _to_response(result)
+
+
+@router.post("/compare/batch", response_model=List[RedlineCompareResponse])
+async def compare_versions_batch(
+    request: RedlineBatchCompareRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    複数のバージョン組をまとめて比較し、組ごとの差分解析とAIリスク評価を返す
+    AI解析は1回のバッチ呼び出しで並行実行され、解析済みの組はキャッシュから返す
+    """
+    # 同一セッションは並行利用できないため、バージョンの検証と読み込みは順に行う
+    pairs = []
+    for pair in request.pairs:
+        _, _, old_file_path, new_file_path, old_file_content, new_file_content = await _load_version_files(db, pair)
+        pairs.append({
+            "old_file_content": old_file_content,
+            "new_file_content": new_file_content,
+            "old_version_id": pair.old_version_id,
+            "new_version_id": pair.new_version_id,
+            "old_filename": os.path.basename(old_file_path),
+            "new_filename": os.path.basename(new_file_path),
+        })
+    
+    print(f"🔄 Comparing {len(pairs)} version pairs")
+    results = await redline_service.compare_versions_batch(pairs)
+    return [_to_response(result) for result in results]
+
+
+@router.post("/compare/diff-html")
+async def stream_diff_html(
+    request: RedlineCompareRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    2つのバージョンの差分HTMLのみを逐次返す（AI解析なし）
+    大きな差分でもブラウザが受信した行から表示を開始できる
+    """
+    _, _, old_file_path, new_file_path, old_file_content, new_file_content = await _load_version_files(db, request)
+    
+    return StreamingResponse(
+        redline_service.generate_diff_html_stream(
+            old_file_content=old_file_content,
+            new_file_content=new_file_content,
+            old_filename=os.path.basename(old_file_path),
+            new_filename=os.path.basename(new_file_path)
+        ),
+        media_type="text/html"
+    )
+
+
 @router.get("/versions/{case_id}")
 async def get_comparable_versions(
     case_id: str,
@@ -21,6 +21,9 @@ class Settings(BaseSettings):
     # ===== OpenAI API設定 =====
     # GPT-4による契約書解析と判定に使用
     OPENAI_API_KEY: str = ""  # OpenAI APIキー
+    OPENAI_MAX_CONCURRENCY: int = 20  # OpenAIへの同時リクエスト数の上限（レート制限対策）
+    RAG_EMBEDDING_DIMENSIONS: int = 0  # RAG埋め込みの次元数（0はモデル既定の1536、512等で索引サイズを削減）
+    RAG_HNSW_SEARCH_EF: int = 100  # RAG検索時のHNSW探索幅（大きいほど再現率が上がり低速になる）
     
     # ===== データベース設定 =====
     # PostgreSQL非同期接続URL (デフォルトをSQLiteに変更)
@@ -62,6 +65,9 @@ class Settings(BaseSettings):
     # Slack通知設定
     # Webhook URLはユーザー単位でDBに保存するため、ここでは設定不要
     
+    # バックグラウンド送信ワーカー数（APIハンドラは送信完了を待たない。0以下ならその場で送信）
+    NOTIFICATION_WORKERS: int = 4
+    
     # ===== フロントエンドURL設定 =====
     # 通知メール内のリンク生成に使用
     FRONTEND_URL: str = "http://localhost:5173"  # デプロイ時はVercel URLなどに変更
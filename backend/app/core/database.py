@@ -3,6 +3,7 @@ LexFlow Protocol - Database Configuration
 """
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
+from sqlalchemy import inspect, text
 
 from app.core.config import settings
 
@@ -28,6 +29,28 @@ engine = create_async_engine(
     **engine_args
 )
 
+# create_allは既存テーブルに列を追加しないため、モデルに後から追加した列を起動時に補う
+# {テーブル名: [(列名, 列の型)]}
+ADDED_COLUMNS = {
+    "contracts": [("obligation_batch_id", "VARCHAR(64)")],
+    "obligations": [("trigger_offset_days", "INTEGER")],
+}
+
+
+def add_missing_columns(sync_conn) -> None:
+    """
+    既存データベースに不足している列を追加（conn.run_syncから呼び出す）
+    """
+    inspector = inspect(sync_conn)
+    for table, columns in ADDED_COLUMNS.items():
+        if not inspector.has_table(table):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table)}
+        for name, column_type in columns:
+            if name not in existing:
+                sync_conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}"))
+                print(f"🛠️ Added missing column: {table}.{name}")
+
 # Create session factory
 AsyncSessionLocal = async_sessionmaker(
     engine,
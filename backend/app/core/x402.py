@@ -12,9 +12,11 @@ from sqlalchemy import select
 from datetime import datetime
 
 class PaymentVerifier:
-    def __init__(self, amount: float, token_symbol: str = "JPYC", token_address: str = None, recipient_address: str = None):
+    def __init__(self, amount: float, token_symbol: str = "JPYC", token_address: str = None, recipient_address: str = None, per_item_field: str = None):
         from app.core.config import settings
         self.amount = amount
+        # 指定した場合、リクエストボディのこのリスト項目の件数分を課金する（例: contract_ids）
+        self.per_item_field = per_item_field
         self.token_symbol = token_symbol
         self.token_address = token_address or settings.JPYC_CONTRACT_ADDRESS
         self.recipient_address = recipient_address or settings.TREASURY_ADDRESS
@@ -23,11 +25,13 @@ class PaymentVerifier:
         """
         Dependency callable to verify x402 payment
         """
+        amount = await self._required_amount(request)
+        
         # 1. PAYMENT-SIGNATURE ヘッダーを検索 (Format: "tx_hash=0x...")
         signature_header = request.headers.get("PAYMENT-SIGNATURE")
 
         if not signature_header:
-            return await self._raise_payment_required()
+            return await self._raise_payment_required(amount)
 
         try:
             # 2. PAYMENT-SIGNATURE ヘッダーを解析 (Simple MVP: expecting just tx_hash)
@@ -45,7 +49,7 @@ class PaymentVerifier:
                 tx_hash = tx_hash[8:]
             
             if not tx_hash or not tx_hash.startswith("0x"):
-                 return await self._raise_payment_required()
+                 return await self._raise_payment_required(amount)
 
             # 長さチェック（0x + 64文字 = 66文字）
             if len(tx_hash) > 66:
@@ -59,7 +63,8 @@ class PaymentVerifier:
             if existing:
                  # 同一エンドポイントかつ10分以内なら、AI処理の再試行とみなして許可
                  time_diff = (datetime.utcnow() - existing.created_at.replace(tzinfo=None)).total_seconds()
-                 if existing.endpoint == request.url.path and time_diff < 600:
+                 # 件数課金の場合は、記録済みの支払額が今回の必要額を満たす場合のみ
+                 if existing.endpoint == request.url.path and time_diff < 600 and existing.amount >= amount:
                      print(f"ℹ️ Idempotency: Re-using payment for {tx_hash} (endpoint match)")
                      return True
                  else:
@@ -77,7 +82,7 @@ class PaymentVerifier:
                 valid, details = await blockchain_service.verify_token_transfer(
                     tx_hash=tx_hash,
                     expected_recipient=self.recipient_address,
-                    expected_amount=self.amount,
+                    expected_amount=amount,
                     token_address=self.token_address
                 )
                 if valid:
@@ -108,7 +113,7 @@ class PaymentVerifier:
             log = PaymentLog(
                 tx_hash=tx_hash,
                 endpoint=request.url.path,
-                amount=self.amount,
+                amount=amount,
                 token=self.token_symbol,
                 payer=details.get("from", "unknown"),
                 created_at=datetime.utcnow()
@@ -127,10 +132,20 @@ class PaymentVerifier:
                 detail=f"支払い検証システムの内部エラー: {str(e)}"
             )
 
-    async def _raise_payment_required(self):
+    async def _required_amount(self, request: Request) -> float:
+        """このリクエストで必要な支払額（件数課金の場合は単価×件数）"""
+        if not self.per_item_field:
+            return self.amount
+        try:
+            items = (await request.json()).get(self.per_item_field) or []
+        except Exception:
+            items = []
+        return self.amount * max(len(items), 1)
+
+    async def _raise_payment_required(self, amount: float):
         """ヘッダーに支払い情報を含めて402を投げる (初期要求時のみ)"""
         payment_info = json.dumps({
-            "price": self.amount,
+            "price": amount,
             "currency": self.token_symbol,
             "network": "sepolia", 
             "recipient": self.recipient_address,
@@ -9,8 +9,13 @@ import traceback  # スタックトレース取得用
 from contextlib import asynccontextmanager  # 非同期コンテキストマネージャー
 
 from app.core.config import settings  # アプリケーション設定の読み込み
-from app.core.database import engine, Base  # データベースエンジンとベースモデル
+from app.core.database import engine, Base, add_missing_columns  # データベースエンジンとベースモデル
 from app.core.logging_config import setup_logging, get_logger  # ロギング設定
+from app.services.notification_service import notification_service  # 通知送信ワーカー
+from app.services.zk_verifier import zk_verifier  # ZK証明の検証ワーカー
+from app.services.redline_service import redline_service  # 差分解析（共有LLMクライアント）
+from app.services.rag_service import rag_service  # RAG（埋め込みのバッチ処理タスク）
+from app.services.obligation_service import obligation_service  # 義務抽出バッチの取り込み
 from app.api import contracts, judgments, obligations, versions, signatures, redline, zk_proofs, rag  # APIルーターのインポート
 from app.api import auth, rbac, approvals, audit, notifications, users  # V3: 認証、RBAC、承認、監査、通知、ユーザーAPI
 
@@ -29,14 +34,45 @@ async def lifespan(app: FastAPI):
     try:
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)  # 全テーブルを作成
+            await conn.run_sync(add_missing_columns)  # 既存テーブルに追加された列を補う
         logger.info("✅ データベースは接続され、テーブルは作成されました")
     except Exception as e:
         # データベース未接続でも起動を継続（開発用）
         logger.error(f"⚠️ データベース接続に失敗しました: {str(e)}", exc_info=True)
         logger.warning("   開発用: データベース接続なしで起動します - 一部の機能は使用できません")
     
+    # 通知のバックグラウンド送信ワーカーを起動
+    notification_service.start_workers(settings.NOTIFICATION_WORKERS)
+    
+    # 前回終了時に送信されずに残った通知を再登録
+    try:
+        await notification_service.requeue_pending()
+    except Exception as e:
+        logger.error(f"⚠️ 送信待ち通知の再登録に失敗しました: {str(e)}", exc_info=True)
+    
+    # 再起動前に投入された義務抽出バッチの取り込みを再開
+    try:
+        await obligation_service.resume_extraction_batches()
+    except Exception as e:
+        logger.error(f"⚠️ 義務抽出バッチの再開に失敗しました: {str(e)}", exc_info=True)
+    
     yield  # アプリケーション実行中
     
+    # 終了時: 送信待ちの通知を処理してからワーカーを停止
+    await notification_service.stop_workers()
+    
+    # 終了時: 義務抽出バッチの完了待ちを停止（バッチIDは契約に残り、次回起動時に再開）
+    await obligation_service.stop_batch_ingestion()
+    
+    # 終了時: ZK証明の検証ワーカーを終了
+    await zk_verifier.close()
+    
+    # 終了時: 差分解析用LLMのHTTP接続を閉じる
+    await redline_service.close()
+    
+    # 終了時: 埋め込みのバッチ処理タスクを停止し、OpenAI APIの接続を閉じる
+    await rag_service.close()
+    
     # 終了時: データベース接続のクリーンアップ
     try:
         await engine.dispose()
@@ -1,7 +1,7 @@
 """
 LexFlow Protocol - Database Models
 """
-from sqlalchemy import Column, String, Integer, Float, DateTime, Text, Enum, ForeignKey, Boolean
+from sqlalchemy import Column, String, Integer, Float, DateTime, Text, Enum, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.core.database import Base
@@ -40,6 +40,7 @@ class Contract(Base):
     blockchain_tx_hash = Column(String(66), nullable=True)
     parties = Column(Text, nullable=True)  # JSON文字列の当事者リスト
     summary = Column(Text, nullable=True)  # 契約書の要約
+    obligation_batch_id = Column(String(64), nullable=True)  # 結果の取り込み待ちの義務抽出バッチID（OpenAI Batch API）
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
@@ -157,6 +158,7 @@ class Obligation(Base):
     type = Column(Enum(ObligationType), nullable=False)  # 義務タイプ
     due_date = Column(DateTime(timezone=True), nullable=True)  # 期限日（相対期限の場合はnull）
     trigger_condition = Column(Text, nullable=True)  # トリガー条件（例: "契約開始日から30日"）
+    trigger_offset_days = Column(Integer, nullable=True)  # トリガー条件から解析した契約開始日からの日数（前の場合は負数）
     responsible_party = Column(Enum(PartyType), nullable=False)  # 責任者
     action = Column(Text, nullable=False)  # 実行すべきアクション（例: "通知する", "支払う"）
     evidence_required = Column(Text, nullable=True)  # 必要な証跡（JSON配列の文字列）
@@ -181,6 +183,11 @@ class Obligation(Base):
     # リレーションシップ
     contract = relationship("Contract", back_populates="obligations")
     edit_history = relationship("ObligationEditHistory", back_populates="obligation", cascade="all, delete-orphan")
+    
+    # 期限チェック（DUE_SOON/OVERDUE更新）のstatus + due_date範囲検索用
+    __table_args__ = (
+        Index("ix_obligations_status_due_date", "status", "due_date"),
+    )
 
 # ===== V2: 義務編集履歴モデル（F2用） =====
 class ObligationEditHistory(Base):
@@ -242,6 +249,11 @@ class ContractVersion(Base):
     
     # リレーションシップ
     signatures = relationship("Signature", back_populates="contract_version", cascade="all, delete-orphan")
+    
+    # 案件ごとの最新版番号の取得・版一覧の並び替え用
+    __table_args__ = (
+        Index("ix_contract_versions_case_id_version", "case_id", "version"),
+    )
 
 # ===== V2: 署名モデル（F3用） =====
 class Signature(Base):
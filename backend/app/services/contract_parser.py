@@ -10,6 +10,7 @@ from pydantic import BaseModel, Field  # Pydanticモデル
 import json  # JSON処理
 from pypdf import PdfReader  # PDF読み込み
 import io  # バイトストリーム処理
+import asyncio  # ブロッキング処理のスレッド実行用
 import hashlib  # ハッシュ生成
 
 from app.core.config import settings  # 設定のインポート
@@ -70,14 +71,17 @@ class ContractParserService:
     async def extract_pdf_text(self, pdf_content: bytes) -> str:
         """
         PDFファイルからテキストを抽出
+        解析はCPU処理のためスレッドで実行し、イベントループをブロックしない
         """
+        return await asyncio.to_thread(self._extract_pdf_text_sync, pdf_content)
+
+    @staticmethod
+    def _extract_pdf_text_sync(pdf_content: bytes) -> str:
+        """PDFファイルからテキストを抽出（同期処理）"""
         # バイトストリームからPDFを読み込み
         reader = PdfReader(io.BytesIO(pdf_content))
-        text = ""
         # 全ページのテキストを結合
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        return "".join(page.extract_text() + "\n" for page in reader.pages)
 
     async def extract_text_from_file(self, content: bytes, filename: str) -> str:
         """
@@ -7,12 +7,46 @@ from langchain_openai import ChatOpenAI  # OpenAI ChatGPTインターフェー
 from langchain_core.prompts import ChatPromptTemplate  # プロンプトテンプレート（langchain_coreから）
 from pydantic import BaseModel, Field  # Pydanticモデル
 from datetime import datetime  # 日時処理
+import asyncio  # 同時実行数の制御
 import uuid  # 一意ID生成
 import json  # JSON処理
 
 from app.core.config import settings  # 設定のインポート
 
 
+# 判定用のシステムプロンプト（全リクエストで共通）
+SYSTEM_PROMPT = """あなたは契約条件の履行評価に特化した法務AIアシスタントです。
+            提供されたエビデンスが指定された条件を満たしているかどうかを客観的に評価することが任務です。
+
+            以下のフィールドを含む有効なJSON形式で回答してください：
+            - result: "approved"（承認）または "rejected"（却下）
+            - confidence: 0〜1の間の数値
+            - reason: 詳細な説明文字列
+            - key_factors: 判定に影響を与えた主要ポイントの配列
+
+           徹底的かつ公正に判断してください。以下を考慮してください：
+            1. エビデンスは条件を直接的に証明していますか？
+            2. エビデンスは本物で検証可能ですか？
+            3. 不足点や矛盾点はありませんか？
+            4. エビデンスに基づいて条件が明確に達成されていますか？
+
+            エビデンスが不十分または不明確な場合は、却下寄りの判定を行い、不足している内容を説明してください。"""
+
+# 判定対象ごとに変わる入力を埋め込むプロンプト
+HUMAN_PROMPT = """以下を評価してください：
+
+            **達成すべき条件:**
+            {condition_description}
+
+            **関連する支払金額:**
+            {amount} JPY
+
+            **提供されたエビデンス:**
+            {evidence}
+
+            エビデンスを分析し、条件が達成されているかどうかを判定してください。JSON形式で判定結果を提供してください。"""
+
+
 class JudgmentResult(BaseModel):
     """
     AI判定結果のモデル
@@ -40,6 +74,13 @@ class JudgmentService:
             temperature=0,  # 決定論的な出力（一貫性重視）
             api_key=settings.OPENAI_API_KEY,  # APIキー
         )
+        # LLMへの同時リクエスト数を制限し、429エラーの連鎖を防ぐ
+        self._llm_sem = asyncio.Semaphore(settings.OPENAI_MAX_CONCURRENCY)
+        # プロンプトテンプレートは一度だけ構築して使い回す
+        self._prompt = ChatPromptTemplate.from_messages([
+            ("system", SYSTEM_PROMPT),
+            ("human", HUMAN_PROMPT),
+        ])
     
     async def evaluate_evidence(
         self,
@@ -61,50 +102,30 @@ class JudgmentService:
             JudgmentResult: 承認判定と理由を含む結果オブジェクト
         """
         
+        # エビデンスが無い場合はAIを呼ばずに却下（結果は決定的）
+        has_text = bool(evidence_text and evidence_text.strip())
+        has_url = bool(evidence_url and evidence_url.strip())
+        if not has_text and not has_url:
+            return JudgmentResult(
+                result="rejected",
+                confidence=1.0,
+                reason="エビデンスが提供されていません",
+                key_factors=["エビデンス欠如"]
+            )
+        
         # エビデンス内容を準備
         evidence_content = evidence_text or f"エビデンスURL: {evidence_url}"
         
-        # 判定用のプロンプトを作成
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """あなたは契約条件の履行評価に特化した法務AIアシスタントです。
-            提供されたエビデンスが指定された条件を満たしているかどうかを客観的に評価することが任務です。
-
-            以下のフィールドを含む有効なJSON形式で回答してください：
-            - result: "approved"（承認）または "rejected"（却下）
-            - confidence: 0〜1の間の数値
-            - reason: 詳細な説明文字列
-            - key_factors: 判定に影響を与えた主要ポイントの配列
-
-           徹底的かつ公正に判断してください。以下を考慮してください：
-            1. エビデンスは条件を直接的に証明していますか？
-            2. エビデンスは本物で検証可能ですか？
-            3. 不足点や矛盾点はありませんか？
-            4. エビデンスに基づいて条件が明確に達成されていますか？
-
-            エビデンスが不十分または不明確な場合は、却下寄りの判定を行い、不足している内容を説明してください。"""),
-            ("human", """以下を評価してください：
-
-            **達成すべき条件:**
-            {condition_description}
-
-            **関連する支払金額:**
-            {amount} JPY
-
-            **提供されたエビデンス:**
-            {evidence}
-
-            エビデンスを分析し、条件が達成されているかどうかを判定してください。JSON形式で判定結果を提供してください。""")
-        ])
-        
         # プロンプトをフォーマットしてLLMに送信
-        messages = prompt.format_messages(
+        messages = self._prompt.format_messages(
             condition_description=condition_description,  # 条件説明
             amount=condition_amount,  # 金額
             evidence=evidence_content  # エビデンス
         )
         
         # AIからの応答を取得
-        response = await self.llm.ainvoke(messages)
+        async with self._llm_sem:
+            response = await self.llm.ainvoke(messages)
         
         # JSON応答をパース
         try:
@@ -5,17 +5,43 @@ Email/Slack通知の送信を提供
 import json
 import uuid
 from datetime import datetime
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 import asyncio
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, insert
 
 from app.models.models import Notification, NotificationChannel, NotificationStatus
 from app.core.logging_config import get_logger
 
 logger = get_logger(__name__)
 
+# バックグラウンド送信キュー（start_workersで初期化）
+_queue: Optional[asyncio.Queue] = None
+_workers: List[asyncio.Task] = []
+# 終了時に送信待ちの通知を処理し終えるまで待つ最大秒数
+_STOP_TIMEOUT_SECONDS = 30.0
+
+# Slackボタンのラベル（送信時に変更されないため全ペイロードで共有）
+_APPROVAL_BUTTON_TEXT = {"type": "plain_text", "text": "承認ページを開く"}
+_REQUEST_BUTTON_TEXT = {"type": "plain_text", "text": "リクエストを確認"}
+
+# リマインド通知の緊急度表示（当日・前日のみ固定文言）
+_URGENCY = {0: "⚠️ 本日が期限です", 1: "⚠️ 明日が期限です"}
+
+
+def _section_block(text: str) -> Dict[str, Any]:
+    """mrkdwnセクションブロックを作成"""
+    return {"type": "section", "text": {"type": "mrkdwn", "text": text}}
+
+
+def _button_block(button_text: Dict[str, str], url: str, style: str) -> Dict[str, Any]:
+    """リンクボタン1つを持つactionsブロックを作成"""
+    return {
+        "type": "actions",
+        "elements": [{"type": "button", "text": button_text, "url": url, "style": style}]
+    }
+
 
 class NotificationService:
     """通知サービスクラス"""
@@ -49,7 +75,6 @@ class NotificationService:
         
         # 実際のSMTP送信
         try:
-            import smtplib
             from email.mime.text import MIMEText
             from email.mime.multipart import MIMEMultipart
             
@@ -76,11 +101,8 @@ class NotificationService:
                 part2 = MIMEText(html_body, 'html', 'utf-8')
                 msg.attach(part2)
             
-            # SMTP接続・送信
-            with smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT, timeout=10) as server:
-                server.starttls()  # TLS暗号化
-                server.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
-                server.send_message(msg)
+            # SMTP接続・送信（ブロッキング処理のため、イベントループを止めないようスレッドで実行）
+            await asyncio.to_thread(NotificationService._send_smtp, msg)
             
             logger.info(f"[EMAIL] Successfully sent email to {recipient}")
             return True
@@ -90,6 +112,17 @@ class NotificationService:
             # 送信失敗時もログには記録されているため、Falseを返す
             return False
     
+    @staticmethod
+    def _send_smtp(msg) -> None:
+        """SMTPサーバーに接続してメッセージを送信（同期処理）"""
+        import smtplib
+        from app.core.config import settings
+        
+        with smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT, timeout=10) as server:
+            server.starttls()  # TLS暗号化
+            server.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+            server.send_message(msg)
+    
     # ===== Slack送信 =====
     
     @staticmethod
@@ -157,17 +190,26 @@ class NotificationService:
         db.add(notification)
         await db.flush()
         
+        await NotificationService._deliver(notification, payload)
+        
+        await db.commit()
+        await db.refresh(notification)
+        return notification
+    
+    @staticmethod
+    async def _deliver(notification: Notification, payload: Dict[str, Any]) -> None:
+        """通知を実際に送信し、結果をステータスに反映（コミットは呼び出し側）"""
         try:
-            if channel == NotificationChannel.EMAIL:
+            if notification.channel == NotificationChannel.EMAIL:
                 success = await NotificationService.send_email(
-                    recipient=recipient,
-                    subject=subject or "LexFlow通知",
+                    recipient=notification.recipient,
+                    subject=notification.subject or "LexFlow通知",
                     body=payload.get("body", ""),
                     html_body=payload.get("html_body")
                 )
-            elif channel == NotificationChannel.SLACK:
+            elif notification.channel == NotificationChannel.SLACK:
                 success = await NotificationService.send_slack(
-                    webhook_url=recipient,  # Slackの場合はWebhook URLを使用
+                    webhook_url=notification.recipient,  # Slackの場合はWebhook URLを使用
                     message=payload.get("message", ""),
                     blocks=payload.get("blocks")
                 )
@@ -183,11 +225,175 @@ class NotificationService:
         except Exception as e:
             notification.status = NotificationStatus.FAILED
             notification.error = str(e)
+    
+    # ===== バックグラウンド送信 =====
+    
+    @staticmethod
+    async def enqueue_notification(
+        db: AsyncSession,
+        channel: NotificationChannel,
+        recipient: str,
+        subject: Optional[str],
+        payload: Dict[str, Any]
+    ) -> Notification:
+        """
+        通知をPENDINGで記録し、送信はバックグラウンドワーカーに任せる
         
+        - APIハンドラは送信完了を待たずに返れる
+        - ワーカー未起動時（スクリプト実行など）はその場で送信する
+        """
+        notification = Notification(
+            id=str(uuid.uuid4()),
+            channel=channel,
+            recipient=recipient,
+            subject=subject,
+            payload=json.dumps(payload, ensure_ascii=False),
+            status=NotificationStatus.PENDING
+        )
+        db.add(notification)
         await db.commit()
-        await db.refresh(notification)
+        
+        if _queue is None:
+            await NotificationService._dispatch(notification.id)
+        else:
+            _queue.put_nowait(notification.id)
         return notification
     
+    @staticmethod
+    async def enqueue_many(
+        db: AsyncSession,
+        items: List[Tuple[NotificationChannel, str, Optional[str], Dict[str, Any]]]
+    ) -> List[str]:
+        """
+        複数の通知を1回のINSERTで記録し、まとめて送信キューに登録
+        
+        Args:
+            items: (channel, recipient, subject, payload) のリスト
+            
+        Returns:
+            登録された通知IDのリスト
+        """
+        if not items:
+            return []
+        
+        rows = [
+            {
+                "id": str(uuid.uuid4()),
+                "channel": channel,
+                "recipient": recipient,
+                "subject": subject,
+                "payload": json.dumps(payload, ensure_ascii=False),
+                "status": NotificationStatus.PENDING,
+            }
+            for channel, recipient, subject, payload in items
+        ]
+        await db.execute(insert(Notification), rows)
+        await db.commit()
+        
+        notification_ids = [row["id"] for row in rows]
+        if _queue is None:
+            await asyncio.gather(
+                *(NotificationService._dispatch(nid) for nid in notification_ids),
+                return_exceptions=True
+            )
+        else:
+            for nid in notification_ids:
+                _queue.put_nowait(nid)
+        return notification_ids
+    
+    @staticmethod
+    async def _dispatch(notification_id: str) -> None:
+        """キューから取り出した通知を独立したセッションで送信"""
+        from app.core.database import AsyncSessionLocal
+        
+        async with AsyncSessionLocal() as db:
+            notification = await db.get(Notification, notification_id)
+            if not notification or notification.status != NotificationStatus.PENDING:
+                return
+            payload = json.loads(notification.payload) if notification.payload else {}
+            await NotificationService._deliver(notification, payload)
+            await db.commit()
+    
+    @staticmethod
+    async def _worker() -> None:
+        """送信キューを処理し続けるワーカー"""
+        while True:
+            notification_id = await _queue.get()
+            try:
+                await NotificationService._dispatch(notification_id)
+            except Exception as e:
+                logger.error(f"[NOTIFICATION WORKER] 通知 {notification_id} の送信処理に失敗しました: {str(e)}", exc_info=True)
+            finally:
+                _queue.task_done()
+    
+    @staticmethod
+    def start_workers(num_workers: int) -> None:
+        """
+        送信ワーカーを起動（アプリ起動時に呼び出す）
+        
+        ワーカー数が0以下の場合はキューを作らず、通知はその場で送信する
+        """
+        global _queue
+        if _queue is not None:
+            return
+        if num_workers <= 0:
+            logger.info("[NOTIFICATION] 送信ワーカーは起動せず、通知はその場で送信します")
+            return
+        _queue = asyncio.Queue()
+        for _ in range(num_workers):
+            _workers.append(asyncio.create_task(NotificationService._worker()))
+        logger.info(f"[NOTIFICATION] 送信ワーカーを{num_workers}件起動しました")
+    
+    @staticmethod
+    async def stop_workers() -> None:
+        """
+        キュー内の通知を送信し終えてからワーカーを停止（アプリ終了時に呼び出す）
+        
+        待ちきれなかった通知はPENDINGのまま残り、次回起動時のrequeue_pendingで再送される
+        """
+        global _queue
+        if _queue is None:
+            return
+        try:
+            await asyncio.wait_for(_queue.join(), timeout=_STOP_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning(f"[NOTIFICATION] 送信待ちの通知{_queue.qsize()}件を残してワーカーを停止します")
+        for task in _workers:
+            task.cancel()
+        await asyncio.gather(*_workers, return_exceptions=True)
+        _workers.clear()
+        _queue = None
+    
+    @staticmethod
+    async def requeue_pending() -> int:
+        """
+        PENDINGのまま残っている通知を送信キューに再登録（アプリ起動時に呼び出す）
+        
+        Returns:
+            再登録した通知の件数
+        """
+        from app.core.database import AsyncSessionLocal
+        
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Notification.id).where(Notification.status == NotificationStatus.PENDING)
+            )
+            notification_ids = list(result.scalars().all())
+        
+        if _queue is None:
+            for nid in notification_ids:
+                try:
+                    await NotificationService._dispatch(nid)
+                except Exception as e:
+                    logger.error(f"[NOTIFICATION] 通知 {nid} の再送に失敗しました: {str(e)}", exc_info=True)
+        else:
+            for nid in notification_ids:
+                _queue.put_nowait(nid)
+        
+        if notification_ids:
+            logger.info(f"[NOTIFICATION] 送信待ちの通知{len(notification_ids)}件を再登録しました")
+        return len(notification_ids)
+    
     # ===== 承認依頼通知テンプレート =====
     
     @staticmethod
@@ -228,24 +434,10 @@ class NotificationService:
             "html_body": html_body,
             "message": f"📝 承認依頼: {contract_title} (期限: {due_str})",
             "blocks": [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*📝 承認依頼が届いています*\n\n*契約書:* {contract_title}\n*依頼者:* {requester_name}\n*期限:* {due_str}"
-                    }
-                },
-                {
-                    "type": "actions",
-                    "elements": [
-                        {
-                            "type": "button",
-                            "text": {"type": "plain_text", "text": "承認ページを開く"},
-                            "url": approval_url,
-                            "style": "primary"
-                        }
-                    ]
-                }
+                _section_block(
+                    f"*📝 承認依頼が届いています*\n\n*契約書:* {contract_title}\n*依頼者:* {requester_name}\n*期限:* {due_str}"
+                ),
+                _button_block(_APPROVAL_BUTTON_TEXT, approval_url, "primary")
             ]
         }
     
@@ -261,12 +453,7 @@ class NotificationService:
         """リマインド通知のペイロードを作成"""
         due_str = due_at.strftime("%Y年%m月%d日 %H:%M")
         
-        if days_until_due == 0:
-            urgency = "⚠️ 本日が期限です"
-        elif days_until_due == 1:
-            urgency = "⚠️ 明日が期限です"
-        else:
-            urgency = f"📅 期限まであと{days_until_due}日です"
+        urgency = _URGENCY.get(days_until_due) or f"📅 期限まであと{days_until_due}日です"
         
         body = f"""
 {urgency}
@@ -282,24 +469,12 @@ class NotificationService:
             "body": body.strip(),
             "message": f"{urgency} - {contract_title}",
             "blocks": [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*{urgency}*\n\n*契約書:* {contract_title}\n*期限:* {due_str}"
-                    }
-                },
-                {
-                    "type": "actions",
-                    "elements": [
-                        {
-                            "type": "button",
-                            "text": {"type": "plain_text", "text": "承認ページを開く"},
-                            "url": approval_url,
-                            "style": "danger" if days_until_due <= 1 else "primary"
-                        }
-                    ]
-                }
+                _section_block(f"*{urgency}*\n\n*契約書:* {contract_title}\n*期限:* {due_str}"),
+                _button_block(
+                    _APPROVAL_BUTTON_TEXT,
+                    approval_url,
+                    "danger" if days_until_due <= 1 else "primary"
+                )
             ]
         }
 
@@ -339,27 +514,17 @@ class NotificationService:
                     "text": action_text
                 }
             },
-            {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"*契約書:* {contract_title}\n*担当者:* {assignee_name}\n*コメント:* {comment or 'なし'}"
-                }
-            }
+            _section_block(
+                f"*契約書:* {contract_title}\n*担当者:* {assignee_name}\n*コメント:* {comment or 'なし'}"
+            )
         ]
         
         if request_url:
-            blocks.append({
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "text": {"type": "plain_text", "text": "リクエストを確認"},
-                        "url": request_url,
-                        "style": "primary" if action == "APPROVED" else "danger"
-                    }
-                ]
-            })
+            blocks.append(_button_block(
+                _REQUEST_BUTTON_TEXT,
+                request_url,
+                "primary" if action == "APPROVED" else "danger"
+            ))
             
         return {
             "body": body.strip(),
@@ -376,26 +541,32 @@ class NotificationService:
         subject: Optional[str],
         payload: Dict[str, Any]
     ) -> List[Notification]:
-        """ユーザー設定に合わせてEmailとSlackの両方で通知を送信"""
+        """
+        ユーザー設定に合わせてEmailとSlackの両方で通知を送信
+        
+        送信はバックグラウンドで行うため、返される通知はPENDING状態
+        """
         notifications = []
+        email = getattr(user, 'email', None)
+        slack_webhook_url = getattr(user, 'slack_webhook_url', None)
         
         # Email通知
-        if hasattr(user, 'email') and user.email:
-            n = await NotificationService.create_and_send(
+        if email:
+            n = await NotificationService.enqueue_notification(
                 db=db,
                 channel=NotificationChannel.EMAIL,
-                recipient=user.email,
+                recipient=email,
                 subject=subject or "LexFlow通知",
                 payload=payload
             )
             notifications.append(n)
             
         # Slack通知
-        if hasattr(user, 'slack_webhook_url') and user.slack_webhook_url:
-            n = await NotificationService.create_and_send(
+        if slack_webhook_url:
+            n = await NotificationService.enqueue_notification(
                 db=db,
                 channel=NotificationChannel.SLACK,
-                recipient=user.slack_webhook_url,
+                recipient=slack_webhook_url,
                 subject=None,
                 payload=payload
             )
@@ -3,13 +3,18 @@ LexFlow Protocol - 義務抽出・管理サービス (Version 2: F2)
 
 契約書から義務を自動抽出し、管理するためのサービス
 """
-import json
-import hashlib
+import re
+import enum
+import secrets
+import asyncio
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Set, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, insert, update
 import openai
+import orjson
+from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception_type
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from app.core.config import settings
 from app.models.models import (
@@ -18,34 +23,14 @@ from app.models.models import (
 )
 
 # OpenAI APIクライアントの初期化
-client = openai.AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+# 再試行は_create_extraction_completionのtenacityに一本化する（SDK側の再試行と重ねると、
+# 1回の抽出でセマフォの枠を保持したまま最大で試行回数×SDK再試行回数のリクエストが発生するため）
+client = openai.AsyncOpenAI(api_key=settings.OPENAI_API_KEY, max_retries=0)
+# Batch APIの呼び出しはtenacityで包まないため、SDKの既定の再試行を残したクライアントを使う
+batch_client = client.with_options(max_retries=2)
 
-
-class ObligationService:
-    """義務抽出・管理を担当するサービスクラス"""
-    
-    @staticmethod
-    async def extract_obligations_from_contract(
-        contract_text: str,
-        contract_id: str
-    ) -> List[Dict]:
-        """
-        契約書のテキストから義務を自動抽出
-        
-        Args:
-            contract_text: 契約書の全文テキスト
-            contract_id: 契約ID
-            
-        Returns:
-            抽出された義務のリスト
-        """
-        print(f"🔍 Analyzing contract text: {len(contract_text)} characters")
-        if not contract_text or len(contract_text.strip()) < 10:
-             print("⚠️ Contract text is empty or too short!")
-             return []
-
-        # OpenAI APIを使用して義務を抽出
-        system_prompt = """あなたは契約書解析の専門家です。
+# 義務抽出用のシステムプロンプト
+EXTRACTION_SYSTEM_PROMPT = """あなたは契約書解析の専門家です。
         契約書から以下の情報を抽出してください：
 
         1. 義務のタイトル（簡潔に）
@@ -82,17 +67,193 @@ class ObligationService:
         }
     """
 
+# OpenAIへの同時リクエスト数の上限（全ての抽出呼び出しで共有）
+_openai_sem = asyncio.Semaphore(settings.OPENAI_MAX_CONCURRENCY)
+
+# Batch APIのポーリング間隔（秒）: 完了まで指数的に間隔を広げる
+BATCH_POLL_INITIAL_DELAY = 30
+BATCH_POLL_MAX_DELAY = 600
+# 結果が得られないまま終了したバッチの状態
+BATCH_FINAL_STATUSES = ("failed", "expired", "cancelled")
+# 完了待ちのバッチ取り込みタスク（終了時に停止する）
+_batch_tasks: Set[asyncio.Task] = set()
+
+# 長い契約書はオーバーラップ付きのセグメントに分割して抽出する（条項の境界をまたぐ義務の取りこぼし防止）
+_segment_splitter = RecursiveCharacterTextSplitter(chunk_size=8000, chunk_overlap=500)
+
+# Batch APIのcustom_idで契約IDとセグメント番号を区切る文字
+_SEGMENT_ID_SEP = "#"
+
+
+def _extraction_request_body(contract_text: str) -> Dict:
+    """
+    義務抽出用のChat Completionsリクエストボディを作成
+    通常の呼び出しとBatch APIのJSONL行で共通に使用する
+    """
+    return {
+        # 最新のモデル gpt-4o を使用 (高速・高精度)
+        "model": "gpt-4o",
+        "messages": [
+            {"role": "system", "content": EXTRACTION_SYSTEM_PROMPT},
+            {"role": "user", "content": f"以下の契約書から義務を抽出してください：\n\n{contract_text}"}
+        ],
+        "temperature": 0.1,  # より決定論的な出力のため温度を下げる
+        "response_format": {"type": "json_object"}
+    }
+
+
+@retry(
+    wait=wait_random_exponential(min=1, max=30),
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception_type((openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)),
+    reraise=True
+)
+async def _create_extraction_completion(segment_text: str):
+    """
+    義務抽出のChat Completionsを呼び出す
+    レート制限・一時的な接続エラーはジッター付き指数バックオフで再試行する
+    （待機中は同時実行枠を解放するため、セマフォは試行ごとに取得する）
+    """
+    async with _openai_sem:
+        return await client.chat.completions.create(**_extraction_request_body(segment_text))
+
+
+def _merge_obligations(segment_results: List[List[Dict]]) -> List[Dict]:
+    """
+    セグメントごとの抽出結果を結合
+    オーバーラップ部分で重複した義務は (タイトル, 根拠条項) で除外し、最初に見つかったものを残す
+    """
+    merged: Dict[Tuple, Dict] = {}
+    for obligations in segment_results:
+        for ob in obligations:
+            merged.setdefault((ob.get("title"), ob.get("clause_reference")), ob)
+    return list(merged.values())
+
+
+# COPYで投入する列（順序はレコードのタプルと一致させる）
+_OBLIGATION_COPY_COLUMNS = [
+    "id", "contract_id", "title", "type", "due_date", "trigger_condition",
+    "trigger_offset_days", "responsible_party", "action", "evidence_required", "risk_level",
+    "confidence", "clause_reference", "status", "notes"
+]
+
+
+# AI出力の文字列からEnumへの変換表
+_TYPE_MAP = {m.value: m for m in ObligationType}
+_PARTY_MAP = {m.value: m for m in PartyType}
+_RISK_MAP = {m.value: m for m in RiskLevel}
+
+
+# トリガー条件「契約開始日からN日(前|後)」の解析用
+_TRIGGER_RE = re.compile(r"契約開始日から(\d+)日(前|後)?")
+
+
+def _parse_trigger_offset(trigger_condition: Optional[str]) -> Optional[int]:
+    """トリガー条件から契約開始日からの日数を取得（「前」は負数、解析できない場合はNone）"""
+    if not trigger_condition:
+        return None
+    match = _TRIGGER_RE.search(trigger_condition)
+    if not match:
+        return None
+    days = int(match.group(1))
+    return -days if match.group(2) == "前" else days
+
+
+def _lower(value) -> Optional[str]:
+    """文字列なら小文字化し、それ以外（None等）はNoneを返す"""
+    return value.lower() if isinstance(value, str) else None
+
+
+def _build_obligation_row(
+    contract_id: str,
+    title: str,
+    type: str,
+    due_date: Optional[datetime],
+    trigger_condition: Optional[str],
+    responsible_party: str,
+    action: str,
+    evidence_required: List[str],
+    risk_level: str,
+    confidence: Optional[float],
+    clause_reference: Optional[str],
+    notes: Optional[str] = None
+) -> Dict:
+    """義務1件分の列値を作成（ID生成・Enum変換を含む）"""
+    # IDを生成（16桁のランダムな16進数）
+    obligation_id = secrets.token_hex(8)
+    
+    # 証跡リストをJSON文字列に変換（orjsonは非ASCII文字をエスケープしない）
+    evidence_json = orjson.dumps(evidence_required).decode()
+    
+    # Enum変換（未知の値はデフォルト値を使用）
+    ob_type = _TYPE_MAP.get(_lower(type), ObligationType.OTHER)
+    ob_party = _PARTY_MAP.get(_lower(responsible_party), PartyType.UNKNOWN)
+    ob_risk = _RISK_MAP.get(_lower(risk_level), RiskLevel.LOW)
+
+    return {
+        "id": obligation_id,
+        "contract_id": contract_id,
+        "title": title,
+        "type": ob_type,
+        "due_date": due_date,
+        "trigger_condition": trigger_condition,
+        # 期限日が未確定の場合のみ、契約署名時に期限日を確定できるよう日数を保持
+        "trigger_offset_days": _parse_trigger_offset(trigger_condition) if due_date is None else None,
+        "responsible_party": ob_party,
+        "action": action,
+        "evidence_required": evidence_json,
+        "risk_level": ob_risk,
+        "confidence": confidence,
+        "clause_reference": clause_reference,
+        "status": ObligationStatus.PENDING,
+        "notes": notes
+    }
+
+
+class ObligationService:
+    """義務抽出・管理を担当するサービスクラス"""
+    
+    @staticmethod
+    async def extract_obligations_from_contract(
+        contract_text: str,
+        contract_id: str
+    ) -> List[Dict]:
+        """
+        契約書のテキストから義務を自動抽出
+        
+        Args:
+            contract_text: 契約書の全文テキスト
+            contract_id: 契約ID
+            
+        Returns:
+            抽出された義務のリスト
+        """
+        print(f"🔍 Analyzing contract text: {len(contract_text)} characters")
+        if not contract_text or len(contract_text.strip()) < 10:
+             print("⚠️ Contract text is empty or too short!")
+             return []
+
+        # 契約書をセグメントに分割し、各セグメントの抽出を並行実行
+        segments = _segment_splitter.split_text(contract_text)
+        results = await asyncio.gather(
+            *(ObligationService._extract_segment(segment) for segment in segments)
+        )
+        obligations = _merge_obligations(results)
+        print(f"✅ Extracted {len(obligations)} obligations from {len(segments)} segment(s)")
+        
+        return obligations
+    
+    @staticmethod
+    async def _extract_segment(segment_text: str) -> List[Dict]:
+        """
+        契約書の1セグメントから義務を抽出（OpenAIへの同時リクエスト数はセマフォで制限）
+        
+        Returns:
+            抽出された義務のリスト（失敗時は空リスト）
+        """
+        # OpenAI APIを使用して義務を抽出
         try:
-            # 最新のモデル gpt-4o を使用 (高速・高精度)
-            response = await client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"以下の契約書から義務を抽出してください：\n\n{contract_text[:10000]}"}  # 文字数上限を拡張
-                ],
-                temperature=0.1,  # より決定論的な出力のため温度を下げる
-                response_format={"type": "json_object"}
-            )
+            response = await _create_extraction_completion(segment_text)
             
             # レスポンスをパース
             content = response.choices[0].message.content
@@ -102,11 +263,8 @@ class ObligationService:
                  
             print(f"🤖 AI Response: {content[:500]}...") # ログ出力拡張
             
-            result = json.loads(content)
-            obligations = result.get("obligations", [])
-            print(f"✅ Extracted {len(obligations)} obligations from AI response")
-            
-            return obligations
+            result = orjson.loads(content)
+            return result.get("obligations", [])
             
         except Exception as e:
             print(f"❌ 義務抽出中のAIエラー: {str(e)}")
@@ -114,6 +272,247 @@ class ObligationService:
             traceback.print_exc()
             return []
     
+    @staticmethod
+    async def extract_many(contracts: List[Tuple[str, str]]) -> List[List[Dict]]:
+        """
+        複数契約の義務抽出を並行実行（対話的な取り込み向け）
+        
+        同時リクエスト数はOPENAI_MAX_CONCURRENCYで制限される
+        
+        Args:
+            contracts: (契約ID, 契約書テキスト) のリスト
+            
+        Returns:
+            入力と同じ順序の抽出結果リスト（失敗した契約は空リスト）
+        """
+        results = await asyncio.gather(
+            *(
+                ObligationService.extract_obligations_from_contract(
+                    contract_text=contract_text,
+                    contract_id=contract_id
+                )
+                for contract_id, contract_text in contracts
+            ),
+            return_exceptions=True
+        )
+        return [[] if isinstance(r, Exception) else r for r in results]
+    
+    @staticmethod
+    async def submit_extraction_batch(db: AsyncSession, contracts: List[Tuple[str, str]]) -> str:
+        """
+        複数契約の義務抽出をOpenAI Batch APIに一括投入
+        
+        大量取り込み向け（24時間以内に完了、通常呼び出しより低コスト）
+        バッチIDは契約に保存し、再起動後も結果を取り込めるようにする
+        
+        Args:
+            db: データベースセッション
+            contracts: (契約ID, 契約書テキスト) のリスト
+            
+        Returns:
+            OpenAIのバッチID
+        """
+        # 長い契約書はセグメントごとに1行とし、custom_idに「契約ID#セグメント番号」を設定
+        lines = [
+            orjson.dumps({
+                "custom_id": f"{contract_id}{_SEGMENT_ID_SEP}{index}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": _extraction_request_body(segment)
+            })
+            for contract_id, contract_text in contracts
+            for index, segment in enumerate(_segment_splitter.split_text(contract_text))
+        ]
+        batch_file = await batch_client.files.create(
+            file=("obligation_extraction.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        )
+        batch = await batch_client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        
+        await db.execute(
+            update(Contract)
+            .where(Contract.id.in_([contract_id for contract_id, _ in contracts]))
+            .values(obligation_batch_id=batch.id)
+        )
+        await db.commit()
+        
+        print(f"📦 義務抽出バッチを投入しました: {batch.id} ({len(contracts)} contracts, {len(lines)} segments)")
+        return batch.id
+    
+    @staticmethod
+    async def _read_batch_output(batch) -> Dict[str, List[Dict]]:
+        """完了したバッチの出力ファイルを読み、契約IDごとの抽出結果を返す"""
+        if not batch.output_file_id:
+            return {}
+        
+        output = await batch_client.files.content(batch.output_file_id)
+        segment_results: Dict[str, List[List[Dict]]] = {}
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") != 200:
+                print(f"⚠️ バッチ内の義務抽出に失敗: {record.get('custom_id')}: {record.get('error')}")
+                continue
+            try:
+                content = response["body"]["choices"][0]["message"]["content"]
+                contract_id = record["custom_id"].rsplit(_SEGMENT_ID_SEP, 1)[0]
+                segment_results.setdefault(contract_id, []).append(
+                    orjson.loads(content).get("obligations", [])
+                )
+            except (KeyError, IndexError, TypeError, orjson.JSONDecodeError) as e:
+                print(f"⚠️ バッチ応答の解析に失敗: {record.get('custom_id')}: {str(e)}")
+        
+        # セグメント単位の結果を契約ごとに結合
+        results = {
+            contract_id: _merge_obligations(segments)
+            for contract_id, segments in segment_results.items()
+        }
+        print(f"✅ 義務抽出バッチ完了: {batch.id} ({len(results)} contracts)")
+        return results
+    
+    @staticmethod
+    async def wait_extraction_batch(batch_id: str) -> Dict[str, List[Dict]]:
+        """
+        バッチの完了を待ち、契約IDごとの抽出結果を返す
+        
+        Args:
+            batch_id: submit_extraction_batchが返したバッチID
+            
+        Returns:
+            {契約ID: 抽出された義務のリスト}（失敗したバッチは空の辞書）
+        """
+        delay = BATCH_POLL_INITIAL_DELAY
+        while True:
+            batch = await batch_client.batches.retrieve(batch_id)
+            if batch.status == "completed":
+                break
+            if batch.status in BATCH_FINAL_STATUSES:
+                print(f"❌ 義務抽出バッチが終了しました: {batch_id} ({batch.status})")
+                return {}
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BATCH_POLL_MAX_DELAY)
+        
+        return await ObligationService._read_batch_output(batch)
+    
+    @staticmethod
+    async def _save_batch_results(batch_id: str, results: Dict[str, List[Dict]]) -> int:
+        """
+        バッチの抽出結果をデータベースに保存し、契約の取り込み待ちバッチIDを解除
+        
+        契約ごとにバッチIDの解除と義務の保存を同じトランザクションで行うため、
+        同じバッチを複数の経路（常駐タスクと取り込みAPI）から処理しても二重に保存されない
+        
+        Returns:
+            義務を保存した契約数
+        """
+        from app.core.database import AsyncSessionLocal
+        
+        saved = 0
+        async with AsyncSessionLocal() as db:
+            for contract_id, extracted in results.items():
+                try:
+                    claimed = await db.execute(
+                        update(Contract)
+                        .where(Contract.id == contract_id, Contract.obligation_batch_id == batch_id)
+                        .values(obligation_batch_id=None)
+                    )
+                    if claimed.rowcount == 0:
+                        # 取り込み済み、または新しいバッチが投入済み
+                        continue
+                    await ObligationService.create_obligations_bulk(db, contract_id, extracted)
+                    saved += 1
+                except Exception as e:
+                    # 解除もロールバックされるため、次回の再開時に再度取り込まれる
+                    print(f"❌ 義務保存失敗: {contract_id}: {str(e)}")
+                    await db.rollback()
+            
+            # 結果が無かった契約（抽出失敗・バッチ失敗）は取り込み待ちを解除
+            await db.execute(
+                update(Contract)
+                .where(
+                    Contract.obligation_batch_id == batch_id,
+                    Contract.id.not_in(list(results))
+                )
+                .values(obligation_batch_id=None)
+            )
+            await db.commit()
+        
+        return saved
+    
+    @staticmethod
+    async def ingest_extraction_batch(batch_id: str) -> None:
+        """
+        バッチの完了を待ち、抽出された義務をデータベースに保存
+        
+        リクエスト処理とは独立したバックグラウンドタスクとして実行する
+        """
+        results = await ObligationService.wait_extraction_batch(batch_id)
+        await ObligationService._save_batch_results(batch_id, results)
+    
+    @staticmethod
+    async def collect_extraction_batch(batch_id: str) -> Tuple[str, int]:
+        """
+        バッチの状態を1回だけ確認し、終了していれば結果を取り込む（待機しない）
+        
+        Returns:
+            (バッチの状態, 今回義務を保存した契約数)
+        """
+        batch = await batch_client.batches.retrieve(batch_id)
+        if batch.status == "completed":
+            results = await ObligationService._read_batch_output(batch)
+        elif batch.status in BATCH_FINAL_STATUSES:
+            results = {}
+        else:
+            return batch.status, 0
+        
+        saved = await ObligationService._save_batch_results(batch_id, results)
+        return batch.status, saved
+    
+    @staticmethod
+    def start_batch_ingestion(batch_id: str) -> None:
+        """バッチの取り込みを常駐タスクとして開始（終了時はstop_batch_ingestionで停止）"""
+        task = asyncio.create_task(ObligationService.ingest_extraction_batch(batch_id))
+        _batch_tasks.add(task)
+        task.add_done_callback(_batch_tasks.discard)
+    
+    @staticmethod
+    async def resume_extraction_batches() -> int:
+        """
+        起動時に、取り込み待ちのバッチIDを持つ契約からバッチの取り込みを再開
+        
+        Returns:
+            再開したバッチ数
+        """
+        from app.core.database import AsyncSessionLocal
+        
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Contract.obligation_batch_id)
+                .where(Contract.obligation_batch_id.is_not(None))
+                .distinct()
+            )
+            batch_ids = list(result.scalars().all())
+        
+        for batch_id in batch_ids:
+            ObligationService.start_batch_ingestion(batch_id)
+        if batch_ids:
+            print(f"📦 義務抽出バッチの取り込みを再開しました: {len(batch_ids)} batches")
+        return len(batch_ids)
+    
+    @staticmethod
+    async def stop_batch_ingestion() -> None:
+        """待機中のバッチ取り込みタスクを停止（バッチIDは契約に残り、次回起動時に再開される）"""
+        tasks = list(_batch_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
     @staticmethod
     async def create_obligation(
         db: AsyncSession,
@@ -140,55 +539,96 @@ class ObligationService:
         Returns:
             作成された義務オブジェクト
         """
-        # IDを生成（ハッシュベース）
-        obligation_id = hashlib.sha256(
-            f"{contract_id}:{title}:{datetime.now().isoformat()}".encode()
-        ).hexdigest()[:16]
-        
-        # 証跡リストをJSON文字列に変換
-        evidence_json = json.dumps(evidence_required, ensure_ascii=False)
-        
-        # Enum変換（エラー時はデフォルト値を使用）
-        try:
-            ob_type = ObligationType(type.lower())
-        except (ValueError, AttributeError):
-            ob_type = ObligationType.OTHER
-            
-        try:
-            ob_party = PartyType(responsible_party.lower())
-        except (ValueError, AttributeError):
-            ob_party = PartyType.UNKNOWN
-            
-        try:
-            ob_risk = RiskLevel(risk_level.lower())
-        except (ValueError, AttributeError):
-            ob_risk = RiskLevel.LOW
-
-        # Obligationオブジェクトを作成
-        obligation = Obligation(
-            id=obligation_id,
+        row = _build_obligation_row(
             contract_id=contract_id,
             title=title,
-            type=ob_type,
+            type=type,
             due_date=due_date,
             trigger_condition=trigger_condition,
-            responsible_party=ob_party,
+            responsible_party=responsible_party,
             action=action,
-            evidence_required=evidence_json,
-            risk_level=ob_risk,
+            evidence_required=evidence_required,
+            risk_level=risk_level,
             confidence=confidence,
             clause_reference=clause_reference,
-            status=ObligationStatus.PENDING,
             notes=notes
         )
         
-        # データベースに保存
-        db.add(obligation)
+        # データベースに保存（RETURNINGでサーバー側のデフォルト値も同時に取得し、refreshのSELECTを省く）
+        result = await db.execute(insert(Obligation).values(**row).returning(Obligation))
+        obligation = result.scalar_one()
         await db.commit()
-        await db.refresh(obligation)
         
         return obligation
     
+    @staticmethod
+    async def create_obligations_bulk(
+        db: AsyncSession,
+        contract_id: str,
+        obligation_dicts: List[Dict]
+    ) -> List[Obligation]:
+        """
+        AIが抽出した義務をまとめて作成（コミットは1回）
+        
+        - asyncpg（PostgreSQL）ではCOPYで一括投入
+        - それ以外のドライバでは複数行INSERTで投入
+        
+        Args:
+            db: データベースセッション
+            contract_id: 契約ID
+            obligation_dicts: extract_obligations_from_contractの抽出結果
+            
+        Returns:
+            作成された義務のリスト
+        """
+        rows = [
+            _build_obligation_row(
+                contract_id=contract_id,
+                title=ob_data.get("title"),
+                type=ob_data.get("type"),
+                due_date=None,  # 文字列の日付をパースする場合は別途実装
+                trigger_condition=ob_data.get("trigger_condition"),
+                responsible_party=ob_data.get("responsible_party"),
+                action=ob_data.get("action"),
+                evidence_required=ob_data.get("evidence_required", []),
+                risk_level=ob_data.get("risk_level", "low"),
+                confidence=ob_data.get("confidence"),
+                clause_reference=ob_data.get("clause_reference")
+            )
+            for ob_data in obligation_dicts
+            # 必須列が欠けた抽出結果は一括投入全体を失敗させないよう除外
+            if ob_data.get("title") and ob_data.get("action")
+        ]
+        if not rows:
+            return []
+        
+        conn = await db.connection()
+        if conn.dialect.driver == "asyncpg":
+            # Enum列はSQLAlchemyの既定どおりメンバー名で格納する
+            records = [
+                tuple(
+                    row[col].name if isinstance(row[col], enum.Enum) else row[col]
+                    for col in _OBLIGATION_COPY_COLUMNS
+                )
+                for row in rows
+            ]
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                Obligation.__tablename__,
+                records=records,
+                columns=_OBLIGATION_COPY_COLUMNS
+            )
+        else:
+            await db.execute(insert(Obligation), rows)
+        
+        await db.commit()
+        
+        # server_default（created_at）を含めて読み直す
+        result = await db.execute(
+            select(Obligation).where(Obligation.id.in_([row["id"] for row in rows]))
+        )
+        return list(result.scalars().all())
+    
     @staticmethod
     async def update_obligation(
         db: AsyncSession,
@@ -217,7 +657,8 @@ class ObligationService:
         if not obligation:
             return None
         
-        # 各フィールドの変更を記録
+        # 各フィールドの変更を記録（履歴はまとめて1回のINSERTで保存）
+        history_rows = []
         for field_name, new_value in updated_fields.items():
             if hasattr(obligation, field_name):
                 old_value = getattr(obligation, field_name)
@@ -225,28 +666,29 @@ class ObligationService:
                 # 値が変更された場合のみ履歴を記録
                 if old_value != new_value:
                     # 編集履歴を作成
-                    history_id = hashlib.sha256(
-                        f"{obligation_id}:{field_name}:{datetime.now().isoformat()}".encode()
-                    ).hexdigest()[:16]
-                    
-                    history = ObligationEditHistory(
-                        id=history_id,
-                        obligation_id=obligation_id,
-                        edited_by=edited_by,
-                        field_name=field_name,
-                        old_value=str(old_value) if old_value is not None else None,
-                        new_value=str(new_value) if new_value is not None else None
-                    )
-                    db.add(history)
+                    history_rows.append({
+                        "id": secrets.token_hex(8),
+                        "obligation_id": obligation_id,
+                        "edited_by": edited_by,
+                        "field_name": field_name,
+                        "old_value": str(old_value) if old_value is not None else None,
+                        "new_value": str(new_value) if new_value is not None else None
+                    })
                     
                     # 値を更新
                     setattr(obligation, field_name, new_value)
         
-        # 更新日時を更新
+        if history_rows:
+            await db.execute(insert(ObligationEditHistory), history_rows)
+        
+        # トリガー条件が編集された場合は日数を再解析
+        if "trigger_condition" in updated_fields:
+            obligation.trigger_offset_days = _parse_trigger_offset(obligation.trigger_condition)
+        
+        # 更新日時を更新（値はPython側で設定するため、コミット後のrefreshは不要）
         obligation.updated_at = datetime.now()
         
         await db.commit()
-        await db.refresh(obligation)
         
         return obligation
     
@@ -276,7 +718,8 @@ class ObligationService:
     async def update_obligation_status_from_blockchain(
         db: AsyncSession,
         contract_id: str,
-        event_type: str
+        event_type: str,
+        signed_at: Optional[datetime] = None
     ) -> None:
         """
         ブロックチェーンイベントに基づいて義務のステータスを更新
@@ -284,8 +727,30 @@ class ObligationService:
         Args:
             db: データベースセッション
             contract_id: 契約ID
-            event_type: イベントタイプ（例: "payment_executed", "condition_approved"）
+            event_type: イベントタイプ（例: "payment_executed", "contract_signed"）
+            signed_at: 契約開始日（contract_signedの場合、省略時は現在日時）
         """
+        if event_type == "contract_signed":
+            # 契約署名時: 期限日未設定でトリガー条件を持つ義務の期限日を契約開始日から確定
+            # （日付計算はSQLiteでも正しく動くようPython側で行う）
+            start = signed_at or datetime.now()
+            result = await db.execute(
+                select(Obligation).where(
+                    Obligation.contract_id == contract_id,
+                    Obligation.due_date.is_(None),
+                    Obligation.trigger_condition.is_not(None)
+                )
+            )
+            for obligation in result.scalars():
+                offset = obligation.trigger_offset_days
+                if offset is None:
+                    # 列追加前に作成された義務は作成時に解析されていないため、ここで解析
+                    offset = _parse_trigger_offset(obligation.trigger_condition)
+                if offset is not None:
+                    obligation.due_date = start + timedelta(days=offset)
+            await db.commit()
+            return
+        
         # 該当する契約の義務を取得
         obligations = await ObligationService.get_obligations_by_contract(db, contract_id)
         
@@ -295,13 +760,6 @@ class ObligationService:
                 # 支払が実行された場合、支払義務を完了にする
                 obligation.status = ObligationStatus.COMPLETED
                 obligation.completed_at = datetime.now()
-                
-            elif event_type == "contract_signed":
-                # 契約署名時に更新義務などの基準日を設定
-                if obligation.trigger_condition and "契約開始日" in obligation.trigger_condition:
-                    # トリガー条件をパースして期限を計算（簡易実装）
-                    # 例: "契約開始日から30日前" → 30日前の日付を設定
-                    pass  # TODO: より詳細な条件パースロジックを実装
         
         await db.commit()
     
@@ -318,27 +776,31 @@ class ObligationService:
             期限間近の義務リスト
         """
         from app.services.notification_service import notification_service
-        from app.models.models import User, Contract
+        from app.models.models import User, Contract, NotificationChannel
         
         now = datetime.now()
         seven_days_later = now + timedelta(days=7)
         
-        # 7日以内に期限が来る義務を取得
+        # 7日以内に期限が来る義務を1回のUPDATEで DUE_SOON に更新し、対象行を取得
         result = await db.execute(
-            select(Obligation)
+            update(Obligation)
             .where(
-                Obligation.due_date.isnot(None),
-                Obligation.due_date <= seven_days_later,
+                Obligation.status == ObligationStatus.PENDING,
                 Obligation.due_date > now,
-                Obligation.status == ObligationStatus.PENDING
+                Obligation.due_date <= seven_days_later
             )
+            .values(status=ObligationStatus.DUE_SOON)
+            .returning(Obligation)
+            # セッションに読み込み済みの義務も更新後のステータスで返す
+            .execution_options(synchronize_session=False, populate_existing=True)
         )
         due_soon_obligations = result.scalars().all()
         
-        # ステータスを DUE_SOON に更新し、通知を送信
+        # 送信する通知はまとめて登録する
+        reminders = []
+        
+        # 通知を準備
         for obligation in due_soon_obligations:
-            obligation.status = ObligationStatus.DUE_SOON
-            
             # 通知送信（エラーが発生しても処理は継続）
             try:
                 # 契約書と責任者を取得
@@ -369,30 +831,34 @@ class ObligationService:
                         
                         # Email通知
                         if user.email:
-                            await notification_service.create_and_send(
-                                db=db,
-                                channel="email",
-                                recipient=user.email,
-                                subject=f"期限リマインド: {obligation.action} ({days_until_due}日後)",
-                                payload=payload
-                            )
+                            reminders.append((
+                                NotificationChannel.EMAIL,
+                                user.email,
+                                f"期限リマインド: {obligation.action} ({days_until_due}日後)",
+                                payload
+                            ))
                         
                         # Slack通知
                         if user.slack_webhook_url:
-                            await notification_service.create_and_send(
-                                db=db,
-                                channel="slack",
-                                recipient=user.slack_webhook_url,
-                                subject=None,
-                                payload=payload
-                            )
-                        print(f"[REMINDER] 義務期限リマインド送信: {obligation.id} -> {user.email}")
+                            reminders.append((
+                                NotificationChannel.SLACK,
+                                user.slack_webhook_url,
+                                None,
+                                payload
+                            ))
+                        print(f"[REMINDER] 義務期限リマインド登録: {obligation.id} -> {user.email}")
             except Exception as e:
                 # 通知失敗はログのみ
                 print(f"[NOTIFICATION ERROR] 義務リマインド通知失敗: {str(e)}")
         
         await db.commit()
         
+        # 通知を1回のINSERTで一括登録し、送信はワーカーに任せる
+        try:
+            await notification_service.enqueue_many(db, reminders)
+        except Exception as e:
+            print(f"[NOTIFICATION ERROR] 義務リマインド通知の一括登録に失敗: {str(e)}")
+        
         return due_soon_obligations
 
     
@@ -409,21 +875,20 @@ class ObligationService:
         """
         now = datetime.now()
         
-        # 期限を過ぎた義務を取得
+        # 期限を過ぎた義務を1回のUPDATEで OVERDUE に更新し、対象行を取得
         result = await db.execute(
-            select(Obligation)
+            update(Obligation)
             .where(
-                Obligation.due_date.isnot(None),
-                Obligation.due_date < now,
-                Obligation.status.in_([ObligationStatus.PENDING, ObligationStatus.DUE_SOON])
+                Obligation.status.in_([ObligationStatus.PENDING, ObligationStatus.DUE_SOON]),
+                Obligation.due_date < now
             )
+            .values(status=ObligationStatus.OVERDUE)
+            .returning(Obligation)
+            # セッションに読み込み済みの義務も更新後のステータスで返す
+            .execution_options(synchronize_session=False, populate_existing=True)
         )
         overdue_obligations = result.scalars().all()
         
-        # ステータスを OVERDUE に更新
-        for obligation in overdue_obligations:
-            obligation.status = ObligationStatus.OVERDUE
-        
         await db.commit()
         
         return overdue_obligations
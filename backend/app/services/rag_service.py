@@ -3,15 +3,76 @@ LexFlow Protocol - RAG (Retrieval-Augmented Generation) サービス
 契約書のベクトル化、検索、およびコンテキスト抽出を担当
 """
 import os
+import json
+import asyncio
+import hashlib
+import httpx
 import chromadb
+from cachetools import TTLCache
+from openai import AsyncOpenAI
 from chromadb.config import Settings
 from langchain_community.vectorstores import Chroma
 from langchain_openai import OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Set, Tuple
 
 from app.core.config import settings
 
+# OpenAI APIクライアント（初回使用時に生成し、接続プールをリクエスト間で再利用）
+# close()で閉じた後（アプリの再起動時など）は次の使用時に作り直す
+_openai_client: Optional[AsyncOpenAI] = None
+
+
+def _get_openai_client() -> AsyncOpenAI:
+    """共有のOpenAI APIクライアントを取得（未生成または閉じられていれば作り直す）"""
+    global _openai_client
+    if _openai_client is None or _openai_client.is_closed():
+        _openai_client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+            )
+        )
+    return _openai_client
+
+# 同一クエリの埋め込み・回答をキャッシュする（件数上限と有効期限）
+CACHE_MAXSIZE = 4096
+CACHE_TTL_SECONDS = 3600
+
+# 回答生成に使用するモデル（コスト効率の良いモデル）
+ANSWER_MODEL = "gpt-4o-mini"
+
+ANSWER_SYSTEM_PROMPT = """あなたは契約書の専門家アシスタントです。以下の契約書の抜粋を参照して、ユーザーの質問に正確に答えてください。
+
+【重要な指示】
+- 必ず提供された契約書の内容のみに基づいて回答してください
+- 回答の根拠となる契約書名や条項を明記してください
+- 不確実な場合や契約書に記載がない場合は、「契約書には明記されていません」と正直に答えてください
+- 簡潔で分かりやすい日本語で回答してください
+- 箇条書きを使って整理された回答を心がけてください"""
+
+# 並行するindex_contractの埋め込み要求をまとめる待ち時間（秒）と1回の最大入力数
+EMBED_BATCH_WINDOW_SECONDS = 0.02
+EMBED_BATCH_MAX_INPUTS = 512
+
+# ChromaコレクションのHNSWインデックス設定（コレクションの新規作成時にのみ渡す）
+# 既存コレクションに渡すとメタデータだけが上書きされ、索引の距離関数と食い違うため注意
+# OpenAIの埋め込みは正規化済みのためコサイン距離を使用
+HNSW_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 200,
+    "hnsw:M": 32,
+    "hnsw:search_ef": settings.RAG_HNSW_SEARCH_EF,
+}
+
+NO_CONTEXT_ANSWER = "申し訳ございませんが、関連する契約書の情報が見つかりませんでした。別の表現で質問してみてください。"
+
+
+def _sse(data: Any, event: Optional[str] = None) -> str:
+    """Server-Sent Eventsのフレームを作成（改行を含むテキストもJSONエンコードで1行に収める）"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 class RAGService:
     """
     RAGサービス
@@ -19,9 +80,11 @@ class RAGService:
     """
     
     def __init__(self):
+        # 次元数を指定した場合はMatryoshka表現の先頭次元のみを取得（索引サイズを削減）
         self.embeddings = OpenAIEmbeddings(
             model="text-embedding-3-small",
-            api_key=settings.OPENAI_API_KEY
+            api_key=settings.OPENAI_API_KEY,
+            dimensions=settings.RAG_EMBEDDING_DIMENSIONS or None
         )
         
         # 永続化ストレージのパス設定
@@ -31,21 +94,153 @@ class RAGService:
         # ChromaDB クライアントの初期化
         self.client = chromadb.PersistentClient(path=self.persist_directory)
         
+        # クエリ埋め込みキャッシュ（query -> vector）
+        self._embedding_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL_SECONDS)
+        # 回答キャッシュ（(workspace_id, query, limit) -> query_with_contextの結果）
+        self._answer_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL_SECONDS)
+        # ワークスペースごとのベクターストア（Chromaラッパー）
+        self._vectorstores: Dict[str, Chroma] = {}
+        # 埋め込み要求のマイクロバッチ用キュー（イベントループ上で初回利用時に作成）
+        self._embed_queue: Optional[asyncio.Queue] = None
+        self._embed_task: Optional[asyncio.Task] = None
+        # まとめた埋め込み要求のAPI呼び出し（バッチごとに並行実行し、同時実行数を制限）
+        self._embed_sem = asyncio.Semaphore(settings.OPENAI_MAX_CONCURRENCY)
+        self._embed_calls: Set[asyncio.Task] = set()
+        
         print(f"📦 RAG サービスの初期化: {self.persist_directory}")
 
+    @staticmethod
+    def _collection_name(workspace_id: str) -> str:
+        """
+        ワークスペースIDからコレクション名を生成
+        埋め込みの次元数を変更した場合は次元の異なるベクトルが混在しないよう別コレクションにする
+        """
+        name = f"workspace_{workspace_id.replace('-', '_')}"
+        if settings.RAG_EMBEDDING_DIMENSIONS:
+            name += f"_d{settings.RAG_EMBEDDING_DIMENSIONS}"
+        return name
+
+    def _get_collection(self, workspace_id: str):
+        """
+        ワークスペースごとのChromaコレクションを直接取得
+        存在しない場合のみHNSW設定付きで作成する（既存コレクションの設定は変更しない）
+        """
+        name = self._collection_name(workspace_id)
+        try:
+            return self.client.get_collection(name)
+        except Exception:
+            return self.client.get_or_create_collection(name, metadata=HNSW_METADATA)
+
+    async def _embed_query(self, query: str) -> List[float]:
+        """クエリをベクトル化（キャッシュがあれば再利用）"""
+        embedding = self._embedding_cache.get(query)
+        if embedding is None:
+            embedding = await self.embeddings.aembed_query(query)
+            self._embedding_cache[query] = embedding
+        return embedding
+
+    async def _embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        チャンクをベクトル化
+        同時期に届いた他の契約の要求とまとめて1回のAPI呼び出しで処理する
+        """
+        if self._embed_task is None or self._embed_task.done():
+            self._embed_queue = asyncio.Queue()
+            self._embed_task = asyncio.create_task(self._embed_batcher())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._embed_queue.put((texts, future))
+        return await future
+
+    async def _embed_batcher(self):
+        """埋め込み要求を短時間ためてから一括でベクトル化し、要求ごとに結果を返す"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._embed_queue.get()]
+            total = len(batch[0][0])
+            deadline = loop.time() + EMBED_BATCH_WINDOW_SECONDS
+            
+            # 待ち時間内に届いた要求を上限まで追加
+            while total < EMBED_BATCH_MAX_INPUTS:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._embed_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                total += len(item[0])
+            
+            # API呼び出しは別タスクで実行し、応答を待たずに次のバッチを集める
+            task = asyncio.create_task(self._embed_batch(batch))
+            self._embed_calls.add(task)
+            task.add_done_callback(self._embed_calls.discard)
+
+    async def _embed_batch(self, batch: List[Tuple[List[str], asyncio.Future]]):
+        """まとめた埋め込み要求を1回のAPI呼び出しでベクトル化し、要求ごとに結果を返す"""
+        all_texts = [text for texts, _ in batch for text in texts]
+        try:
+            async with self._embed_sem:
+                vectors = await self.embeddings.aembed_documents(all_texts)
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        # 要求ごとに対応する範囲の結果を返す
+        offset = 0
+        for texts, future in batch:
+            if not future.done():
+                future.set_result(vectors[offset:offset + len(texts)])
+            offset += len(texts)
+
+    async def close(self):
+        """
+        埋め込みのバッチ処理タスクを停止し、OpenAI APIクライアントの接続を閉じる
+        （アプリケーション終了時に呼び出す、クライアントは次の使用時に作り直される）
+        """
+        global _openai_client
+        tasks = list(self._embed_calls)
+        if self._embed_task is not None:
+            tasks.append(self._embed_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._embed_task = None
+        if _openai_client is not None:
+            await _openai_client.close()
+            _openai_client = None
+
+    def _invalidate_answers(self, workspace_id: str):
+        """ワークスペースの内容が変わったため回答キャッシュを破棄"""
+        for key in [k for k in self._answer_cache.keys() if k[0] == workspace_id]:
+            self._answer_cache.pop(key, None)
+
     def _get_vectorstore(self, workspace_id: str):
         """
         ワークスペースごとのベクターストアを取得
         コレクション名は workspace_id をベースにする
+        一度作成したラッパーはプロセス内で再利用する
         """
-        collection_name = f"workspace_{workspace_id.replace('-', '_')}"
-        
-        return Chroma(
-            client=self.client,
-            collection_name=collection_name,
-            embedding_function=self.embeddings,
-            persist_directory=self.persist_directory
-        )
+        vectorstore = self._vectorstores.get(workspace_id)
+        if vectorstore is None:
+            # コレクションは先に作成しておき、ラッパーにはメタデータを渡さない
+            # （渡すと既存コレクションのメタデータが上書きされる）
+            self._get_collection(workspace_id)
+            vectorstore = Chroma(
+                client=self.client,
+                collection_name=self._collection_name(workspace_id),
+                embedding_function=self.embeddings,
+                persist_directory=self.persist_directory
+            )
+            self._vectorstores[workspace_id] = vectorstore
+        return vectorstore
 
     async def index_contract(self, contract_id: str, workspace_id: str, text: str, metadata: Dict[str, Any] = None):
         """
@@ -76,20 +271,40 @@ class RAGService:
         if metadata:
             final_metadata.update(metadata)
             
-        # ベクターストアの取得
-        vectorstore = self._get_vectorstore(workspace_id)
+        # チャンクIDは内容のハッシュから決定し、変更のないチャンクは再ベクトル化しない
+        # （同一内容のチャンクが複数ある場合は1件にまとめる）
+        chunks_by_id = {}
+        for chunk in chunks:
+            digest = hashlib.blake2b(chunk.encode("utf-8"), digest_size=8).hexdigest()
+            chunks_by_id.setdefault(f"{contract_id}:{digest}", chunk)
         
-        # 既存の当該コントラクト情報を削除（再インデックス用）
-        try:
-            vectorstore.delete(where={"contract_id": contract_id})
-        except Exception:
-            pass # 未登録の場合はエラーになるが無視
-            
-        # 登録
-        vectorstore.add_texts(
-            texts=chunks,
-            metadatas=[final_metadata] * len(chunks)
-        )
+        collection = self._get_collection(workspace_id)
+        existing_ids = set(collection.get(where={"contract_id": contract_id}, include=[])["ids"])
+        
+        # 新規チャンクのみ1回のリクエストでベクトル化して登録
+        new_ids = [cid for cid in chunks_by_id if cid not in existing_ids]
+        if new_ids:
+            new_chunks = [chunks_by_id[cid] for cid in new_ids]
+            embeddings = await self._embed_documents(new_chunks)
+            collection.add(
+                ids=new_ids,
+                documents=new_chunks,
+                embeddings=embeddings,
+                metadatas=[final_metadata] * len(new_ids)
+            )
+        
+        # 既存チャンクはメタデータ（タイトル等）のみ更新
+        kept_ids = [cid for cid in chunks_by_id if cid in existing_ids]
+        if kept_ids:
+            collection.update(ids=kept_ids, metadatas=[final_metadata] * len(kept_ids))
+        
+        # 新しい版に存在しないチャンクを削除
+        stale_ids = existing_ids - chunks_by_id.keys()
+        if stale_ids:
+            collection.delete(ids=list(stale_ids))
+        
+        print(f"♻️ {contract_id}: 新規 {len(new_ids)} / 再利用 {len(kept_ids)} / 削除 {len(stale_ids)} チャンク")
+        self._invalidate_answers(workspace_id)
         
         print(f"✅ {contract_id}: ベクトルDBに登録しました")
 
@@ -98,8 +313,14 @@ class RAGService:
         クエリに関連するコンテキストを検索
         """
         vectorstore = self._get_vectorstore(workspace_id)
+        query_embedding = await self._embed_query(query)
         
-        results = vectorstore.similarity_search_with_score(query, k=limit)
+        # Chromaの近傍探索は同期処理のため、イベントループを塞がないようスレッドで実行
+        results = await asyncio.to_thread(
+            vectorstore.similarity_search_by_vector_with_relevance_scores,
+            query_embedding,
+            k=limit
+        )
         
         formatted_results = []
         for doc, score in results:
@@ -111,6 +332,41 @@ class RAGService:
             
         return formatted_results
 
+    @staticmethod
+    def _build_messages(query: str, contexts: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """検索結果から回答生成用のメッセージを作成"""
+        # コンテキストをプロンプト用にフォーマット
+        context_texts = []
+        for idx, ctx in enumerate(contexts, 1):
+            title = ctx["metadata"].get("title", "不明な契約書")
+            content = ctx["content"]
+            context_texts.append(f"【契約書 {idx}: {title}】\n{content}")
+        
+        combined_context = "\n\n".join(context_texts)
+        
+        user_prompt = f"""契約書の抜粋:
+{combined_context}
+
+ユーザーの質問: {query}"""
+
+        return [
+            {"role": "system", "content": ANSWER_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
+    
+    @staticmethod
+    def _format_sources(contexts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """検索結果を引用元情報に整形"""
+        return [
+            {
+                "contract_id": ctx["metadata"].get("contract_id"),
+                "title": ctx["metadata"].get("title", "不明な契約書"),
+                "excerpt": ctx["content"][:200] + "..." if len(ctx["content"]) > 200 else ctx["content"],
+                "relevance_score": 1.0 / (1.0 + ctx["score"])  # スコアを0-1の範囲に正規化
+            }
+            for ctx in contexts
+        ]
+    
     async def query_with_context(self, workspace_id: str, query: str, limit: int = 5) -> Dict[str, Any]:
         """
         RAG検索を実行し、OpenAI APIを使用して質問に対する回答を生成
@@ -119,85 +375,100 @@ class RAGService:
             answer: AIの回答テキスト
             sources: 引用元の契約書情報とチャンク内容のリスト
         """
-        from openai import AsyncOpenAI
+        # 同じ質問への回答が残っていればそのまま返す
+        cache_key = (workspace_id, query, limit)
+        cached = self._answer_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         # 関連コンテキストを検索
         contexts = await self.search_relevant_context(workspace_id, query, limit=limit)
         
         if not contexts:
             return {
-                "answer": "申し訳ございませんが、関連する契約書の情報が見つかりませんでした。別の表現で質問してみてください。",
+                "answer": NO_CONTEXT_ANSWER,
                 "sources": []
             }
         
-        # コンテキストをプロンプト用にフォーマット
-        context_texts = []
-        for idx, ctx in enumerate(contexts, 1):
-            title = ctx["metadata"].get("title", "不明な契約書")
-            content = ctx["content"]
-            context_texts.append(f"【契約書 {idx}: {title}】\n{content}")
-        
-        combined_context = "\n\n".join(context_texts)
-        
-        # OpenAI APIを呼び出し
-        client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        sources = self._format_sources(contexts)
         
-        system_prompt = """あなたは契約書の専門家アシスタントです。以下の契約書の抜粋を参照して、ユーザーの質問に正確に答えてください。
-
-【重要な指示】
-- 必ず提供された契約書の内容のみに基づいて回答してください
-- 回答の根拠となる契約書名や条項を明記してください
-- 不確実な場合や契約書に記載がない場合は、「契約書には明記されていません」と正直に答えてください
-- 簡潔で分かりやすい日本語で回答してください
-- 箇条書きを使って整理された回答を心がけてください"""
-
-        user_prompt = f"""契約書の抜粋:
-{combined_context}
-
-ユーザーの質問: {query}"""
-
         try:
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini",  # コスト効率の良いモデル
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+            response = await _get_openai_client().chat.completions.create(
+                model=ANSWER_MODEL,
+                messages=self._build_messages(query, contexts),
                 temperature=0.3,  # 一貫性のある回答のため低めに設定
                 max_tokens=800
             )
             
-            answer = response.choices[0].message.content
-            
-            # ソース情報を整形
-            sources = []
-            for ctx in contexts:
-                sources.append({
-                    "contract_id": ctx["metadata"].get("contract_id"),
-                    "title": ctx["metadata"].get("title", "不明な契約書"),
-                    "excerpt": ctx["content"][:200] + "..." if len(ctx["content"]) > 200 else ctx["content"],
-                    "relevance_score": 1.0 / (1.0 + ctx["score"])  # スコアを0-1の範囲に正規化
-                })
-            
-            return {
-                "answer": answer,
+            result = {
+                "answer": response.choices[0].message.content,
                 "sources": sources
             }
+            self._answer_cache[cache_key] = result
+            return result
             
         except Exception as e:
             print(f"❌ OpenAI API Error: {e}")
             return {
                 "answer": f"申し訳ございません。回答の生成中にエラーが発生しました: {str(e)}",
-                "sources": [
-                    {
-                        "contract_id": ctx["metadata"].get("contract_id"),
-                        "title": ctx["metadata"].get("title", "不明な契約書"),
-                        "excerpt": ctx["content"][:200] + "...",
-                        "relevance_score": 1.0 / (1.0 + ctx["score"])
-                    }
-                    for ctx in contexts
-                ]
+                "sources": sources
             }
+    
+    async def stream_query_with_context(
+        self, workspace_id: str, query: str, limit: int = 5
+    ) -> AsyncIterator[str]:
+        """
+        query_with_contextのストリーミング版（Server-Sent Events形式のフレームを順に返す）
+        
+        回答のトークンを生成された順に "data:" フレームで送り、
+        最後に引用元を "event: sources" フレームで送る
+        """
+        # 同じ質問への回答が残っていれば一括で返す
+        cache_key = (workspace_id, query, limit)
+        cached = self._answer_cache.get(cache_key)
+        if cached is not None:
+            yield _sse(cached["answer"])
+            yield _sse(cached["sources"], event="sources")
+            return
+        
+        # 関連コンテキストを検索
+        contexts = await self.search_relevant_context(workspace_id, query, limit=limit)
+        
+        if not contexts:
+            yield _sse(NO_CONTEXT_ANSWER)
+            yield _sse([], event="sources")
+            return
+        
+        sources = self._format_sources(contexts)
+        answer_parts = []
+        
+        try:
+            stream = await _get_openai_client().chat.completions.create(
+                model=ANSWER_MODEL,
+                messages=self._build_messages(query, contexts),
+                temperature=0.3,
+                max_tokens=800,
+                stream=True
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    answer_parts.append(delta)
+                    yield _sse(delta)
+            
+            self._answer_cache[cache_key] = {
+                "answer": "".join(answer_parts),
+                "sources": sources
+            }
+            
+        except Exception as e:
+            print(f"❌ OpenAI API Error: {e}")
+            yield _sse(f"申し訳ございません。回答の生成中にエラーが発生しました: {str(e)}", event="error")
+        
+        yield _sse(sources, event="sources")
+
 
 # シングルトンインスタンス
 rag_service = RAGService()
@@ -2,18 +2,274 @@
 LexFlow Protocol - Redline Service
 契約書の差分解析とAIリスク評価を実行するサービス
 """
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, Iterator, AsyncIterator
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
+from cachetools import TTLCache
+from collections import Counter
+import asyncio
 import difflib
-import json
+import hashlib
+import itertools
+import httpx
+import orjson
+from diff_match_patch import diff_match_patch
 import os
 import re
 
 from app.core.config import settings
 from app.services.contract_parser import contract_parser
 
+# AI応答からJSONオブジェクト部分を取り出す（コードブロックや前後の文章を含む場合のフォールバック）
+_JSON_BLOCK_RE = re.compile(r'\{.*\}', re.DOTALL)
+# 変更ブロックの先頭行に付ける番号付きバッジ（<a href="..." に続く部分）
+_BADGE_HTML = '><span style="background-color: #4f46e5; color: white; border-radius: 50%; width: 18px; height: 18px; display: inline-flex; align-items: center; justify-content: center; font-size: 10px; font-weight: bold; margin: 0 2px;">{}</span></a>'
+
+# AI解析結果のキャッシュ（同一の比較を開き直した場合にLLMを再呼び出ししない）
+ANALYSIS_CACHE_MAXSIZE = 1024
+ANALYSIS_CACHE_TTL_SECONDS = 86400
+# プロンプトを変更したら更新し、古いキャッシュを無効化する
+ANALYSIS_PROMPT_VERSION = "5"
+
+# 変更点解析用のシステムプロンプト（全リクエストで共通、可変値はANALYSIS_HUMAN_PROMPT側にのみ埋め込む）
+ANALYSIS_SYSTEM_PROMPT = """あなたは法務専門のAIアシスタントです。契約書の変更点を分析し、リスク評価を行います。
+            
+            変更箇所一覧の「- 削除:」は旧バージョンの行、「- 追加:」は新バージョンの行です。
+            
+            以下の形式でJSON形式の出力を生成してください：
+            
+            {{
+            "summary": "変更内容の要約（日本語、2-3文）",
+            "changes": [
+                {{
+                    "index": 1,
+                    "description": "変更内容の説明",
+                    "change_type": "modify/add/delete",
+                    "risk_level": "high/medium/low",
+                    "risk_reason": "リスク判定の理由",
+                    "recommendation": "対応の提案"
+                }}
+            ],
+            "overall_risk": "high/medium/low",
+            "overall_summary": "全体的なリスク評価のサマリー",
+            "recommendations": ["提案1", "提案2"]
+            }}
+
+            リスク判定基準：
+            - high（高）: 支払条件、責任制限、契約解除、損害賠償に関する重大な変更
+            - medium（中）: 期限、通知義務、秘密保持に関する変更
+            - low（低）: 軽微な文言修正、形式的な変更"""
+
+# 変更点解析用のユーザープロンプト（リクエストごとの可変値のみ）
+ANALYSIS_HUMAN_PROMPT = """以下の契約書の変更点を分析してください。
+            
+            【変更箇所一覧】
+            {changes}
+            
+            【旧バージョン全文（抜粋）】
+            {old_text}
+
+            【新バージョン全文（抜粋）】
+            {new_text}
+
+            上記の変更について、法務観点からのリスク評価と提案をJSON形式で出力してください。"""
+
+# 複数比較のAI解析を並行実行する際の同時リクエスト数の上限
+REDLINE_BATCH_MAX_CONCURRENCY = 8
+
+# 文字単位の差分計算エンジン（状態を持たないため全リクエストで共有）
+_dmp = diff_match_patch()
+
+# AIに渡す抜粋: 変更箇所の前後の文字数と、抜粋全体の文字数上限
+EXCERPT_WINDOW = 300
+EXCERPT_BUDGET = 5000
+_EXCERPT_SEPARATOR = "\n…\n"
+
+
+def _windowed_excerpt(
+    text: str,
+    ranges: List[Tuple[int, int]],
+    window: int = EXCERPT_WINDOW,
+    budget: int = EXCERPT_BUDGET
+) -> str:
+    """
+    変更箇所の文字範囲の前後windowを切り出し、重なる範囲をまとめて連結する
+    合計がbudgetを超えた分は切り捨てる（変更箇所が無い場合は先頭から切り出す）
+    """
+    if not ranges:
+        return text[:budget]
+    
+    merged: List[List[int]] = []
+    for start, end in sorted((max(0, s - window), min(len(text), e + window)) for s, e in ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    
+    parts = []
+    remaining = budget
+    for start, end in merged:
+        if remaining <= 0:
+            break
+        part = text[start:min(end, start + remaining)]
+        parts.append(part)
+        remaining -= len(part)
+    return _EXCERPT_SEPARATOR.join(parts)
+
+
+# splitlinesが行末とみなす文字（改行付きの行から行末を取り除く際に使用）
+_LINE_BREAKS = "\r\n\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+
+
+def _split_lines(text: str) -> List[str]:
+    """
+    テキストを改行付きの行に分割（連結すると元のテキストに戻る）
+    比較ごとに1回だけ分割し、差分ブロックの計算と差分HTMLの生成で共有する
+    """
+    return text.splitlines(keepends=True)
+
+
+def _lines_to_chars(old_lines: List[str], new_lines: List[str]) -> Tuple[str, str, List[str]]:
+    """
+    各行を1文字に置き換えた文字列を作成（diff_match_patchの行単位差分用、diff_linesToCharsと同じ符号化）
+    行末（\r\n / \n の違いや最終行の改行の有無）は比較に含めないため、行末を除いた内容で符号化する
+    
+    Returns:
+        (旧テキストの符号列, 新テキストの符号列, 符号から行への対応表)
+    """
+    line_array = [""]  # diff_match_patchと同様に0番は使用しない
+    line_hash: Dict[str, int] = {}
+    
+    def encode(lines: List[str]) -> str:
+        chars = []
+        for line in lines:
+            line = line.rstrip(_LINE_BREAKS)
+            index = line_hash.get(line)
+            if index is None:
+                index = line_hash[line] = len(line_array)
+                line_array.append(line)
+            chars.append(chr(index))
+        return "".join(chars)
+    
+    return encode(old_lines), encode(new_lines), line_array
+
+
+def _line_span(start_line: int, line_count: int) -> str:
+    """行単位の差分ブロックが占める行範囲（例: L3-5）"""
+    return f"L{start_line}-{start_line + max(line_count - 1, 0)}"
+
+
+# 差分HTMLをストリーミングする際に1回のスレッド処理で生成する行数
+DIFF_STREAM_CHUNK_ROWS = 200
+
+# 差分HTMLのマーカー（difflib内部の変更箇所の印）とHTMLタグの対応
+_DIFF_MARKUP = (
+    ('\0+', '<span class="diff_add">'),
+    ('\0-', '<span class="diff_sub">'),
+    ('\0^', '<span class="diff_chg">'),
+    ('\1', '</span>'),
+    ('\t', '&nbsp;'),
+)
+_ROW_FORMAT = '            <tr><td class="diff_next"%s>%s</td>%s<td class="diff_next">%s</td>%s</tr>\n'
+_TBODY_SEPARATOR = '        </tbody>        \n        <tbody>\n'
+
+
+class _RowHtmlDiff(difflib.HtmlDiff):
+    """
+    HtmlDiff.make_tableと同じ表を、全体を文字列として組み立てずに行単位で生成する
+    
+    make_tableは全行を集めてから「次の変更」リンクを振るため表全体を保持する必要がある。
+    ここでは各変更ブロックの先頭行に番号バッジ（その変更へのアンカー）を付けることで先読みを不要にし、
+    difflibの遅延ジェネレータ（_mdiff）から1行ずつ出力する。
+    """
+    
+    def iter_table(self, fromlines, tolines, fromdesc='', todesc='', numlines=3) -> Iterator[str]:
+        """差分の前後numlines行を含む表を、<tr>単位（とその前後のタグ）で順に返す"""
+        self._make_prefix()
+        prefix = self._prefix[1]
+        # 改行付きの行を受け取るため、行末を取り除いてからタブを展開する
+        fromlines, tolines = self._tab_newline_replace(
+            [line.rstrip(_LINE_BREAKS) for line in fromlines],
+            [line.rstrip(_LINE_BREAKS) for line in tolines]
+        )
+        diffs = difflib._mdiff(fromlines, tolines, numlines, linejunk=self._linejunk, charjunk=self._charjunk)
+        if self._wrapcolumn:
+            diffs = self._line_wrapper(diffs)
+        
+        header_row = '<thead><tr>%s%s%s%s</tr></thead>' % (
+            '<th class="diff_next"><br /></th>',
+            '<th colspan="2" class="diff_header">%s</th>' % fromdesc,
+            '<th class="diff_next"><br /></th>',
+            '<th colspan="2" class="diff_header">%s</th>' % todesc)
+        head, tail = self._table_template.split('%(data_rows)s')
+        yield head % dict(header_row=header_row, prefix=prefix)
+        
+        count = 0
+        in_change = False
+        first = True
+        for fromdata, todata, flag in diffs:
+            if flag is None:
+                # 区切り行（先頭に出力されるものは除く）
+                if not first:
+                    yield _TBODY_SEPARATOR
+                first = False
+                continue
+            first = False
+            
+            anchor = link = ''
+            if flag and not in_change:
+                # 変更ブロックの先頭行に番号バッジを付ける
+                count += 1
+                anchor = ' id="difflib_chg_%s_%d"' % (prefix, count)
+                link = '<a href="#difflib_chg_%s_%d"' % (prefix, count) + _BADGE_HTML.format(count)
+            in_change = bool(flag)
+            
+            row = _ROW_FORMAT % (
+                anchor, link, self._format_line(0, flag, *fromdata),
+                link, self._format_line(1, flag, *todata)
+            )
+            for marker, markup in _DIFF_MARKUP:
+                row = row.replace(marker, markup)
+            yield row
+        
+        if first:
+            no_diff = '<td></td><td>&nbsp;No Differences Found&nbsp;</td>'
+            yield _ROW_FORMAT % ('', '', no_diff, '', no_diff)
+        yield tail
+
+
+def _take_rows(rows: Iterator[str], n: int) -> str:
+    """行のジェネレータから最大n行を取り出して連結（スレッドで実行）"""
+    return "".join(itertools.islice(rows, n))
+
+
+# OpenAI API用のHTTPクライアントと差分解析用のLLM（初回使用時に生成し、モジュール内で共有）
+# close()で閉じた後（アプリの再起動時など）は次の使用時に作り直す
+_http_client: Optional[httpx.AsyncClient] = None
+_llm: Optional[ChatOpenAI] = None
+
+
+def _get_llm() -> ChatOpenAI:
+    """共有のLLMを取得（HTTPクライアントが未生成または閉じられていれば作り直す）"""
+    global _http_client, _llm
+    if _llm is None or _http_client is None or _http_client.is_closed:
+        # 接続プールをリクエスト間・インスタンス間で再利用
+        # 同時接続数は一括比較の並行数を十分に上回るよう設定
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+            timeout=60
+        )
+        _llm = ChatOpenAI(
+            model="gpt-4-turbo-preview",
+            temperature=0,
+            api_key=settings.OPENAI_API_KEY,
+            # JSONモードでJSONオブジェクトのみを返させる
+            model_kwargs={"response_format": {"type": "json_object"}},
+            http_async_client=_http_client,
+        )
+    return _llm
+
 
 class ChangeItem(BaseModel):
     """個々の変更箇所を表すモデル"""
@@ -53,80 +309,227 @@ class RedlineService:
     
     def __init__(self):
         """サービスの初期化"""
-        self.llm = ChatOpenAI(
-            model="gpt-4-turbo-preview",
-            temperature=0,
-            api_key=settings.OPENAI_API_KEY,
-        )
+        # 変更点解析用のプロンプトテンプレート（リクエスト間で共通）
+        self._analysis_prompt = ChatPromptTemplate.from_messages([
+            ("system", ANALYSIS_SYSTEM_PROMPT),
+            ("human", ANALYSIS_HUMAN_PROMPT),
+        ])
+        # AI解析結果のキャッシュ（キー: 入力のSHA-256）
+        self._analysis_cache = TTLCache(maxsize=ANALYSIS_CACHE_MAXSIZE, ttl=ANALYSIS_CACHE_TTL_SECONDS)
     
-    def compute_text_diff(self, old_text: str, new_text: str) -> List[Dict[str, Any]]:
+    @property
+    def llm(self) -> ChatOpenAI:
+        """差分解析用のLLM（モジュール内で共有）"""
+        return _get_llm()
+    
+    def compute_text_diff(
+        self,
+        old_text: str,
+        new_text: str,
+        old_lines: Optional[List[str]] = None,
+        new_lines: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
         """
-        2つのテキスト間の差分を計算し、ブロック単位でまとめる
+        2つのテキスト間の差分を行単位で計算し、ブロック単位でまとめる
+        隣接する削除と追加は置換（replace）ブロックにまとめ、位置は行番号で表す
+        （文字単位の断片ではなく変更行全体をAIに渡すため、行を1文字に置き換えて差分を取る）
+        
+        Args:
+            old_lines, new_lines: _split_linesで分割済みの行（省略時はここで分割）
         """
-        old_lines = old_text.splitlines()
-        new_lines = new_text.splitlines()
+        if old_lines is None:
+            old_lines = _split_lines(old_text)
+        if new_lines is None:
+            new_lines = _split_lines(new_text)
+        old_chars, new_chars, _ = _lines_to_chars(old_lines, new_lines)
+        diffs = _dmp.diff_main(old_chars, new_chars, False)
         
-        matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
         blocks = []
+        old_line = new_line = 1  # 各テキストにおける現在の行番号
+        old_pos = new_pos = 0  # 各テキストにおける現在の文字位置
+        prev_op = diff_match_patch.DIFF_EQUAL
         
-        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
-            if tag == 'equal':
-                continue
-                
-            block = {
-                'type': tag, # 'replace', 'delete', 'insert'
-                'old_text': "\n".join(old_lines[i1:i2]) if tag in ['replace', 'delete'] else None,
-                'new_text': "\n".join(new_lines[j1:j2]) if tag in ['replace', 'insert'] else None,
-                'location': f"L{i1+1}-{i2}" if i1 != i2 else f"L{j1+1}-{j2}"
-            }
-            blocks.append(block)
+        for op, chars in diffs:
+            # 符号列の1文字が1行に対応する。行末を除いて比較しているため、
+            # 本文と文字位置は行末を含む元の行から求める
+            newlines = len(chars)
+            if op == diff_match_patch.DIFF_INSERT:
+                text = "".join(new_lines[new_line - 1:new_line - 1 + newlines])
+            else:
+                text = "".join(old_lines[old_line - 1:old_line - 1 + newlines])
+            
+            if op == diff_match_patch.DIFF_DELETE:
+                blocks.append({
+                    'type': 'delete',
+                    'old_text': text,
+                    'new_text': None,
+                    'location': _line_span(old_line, newlines),
+                    # 文字範囲（AIに渡す抜粋の選択に使用、追加・削除側は挿入位置の空範囲）
+                    'old_range': (old_pos, old_pos + len(text)),
+                    'new_range': (new_pos, new_pos)
+                })
+                old_line += newlines
+                old_pos += len(text)
+            elif op == diff_match_patch.DIFF_INSERT:
+                if prev_op == diff_match_patch.DIFF_DELETE:
+                    # 直前の削除と合わせて置換とする（位置は旧テキスト側）
+                    blocks[-1]['type'] = 'replace'
+                    blocks[-1]['new_text'] = text
+                    blocks[-1]['new_range'] = (new_pos, new_pos + len(text))
+                else:
+                    blocks.append({
+                        'type': 'insert',
+                        'old_text': None,
+                        'new_text': text,
+                        'location': _line_span(new_line, newlines),
+                        'old_range': (old_pos, old_pos),
+                        'new_range': (new_pos, new_pos + len(text))
+                    })
+                new_line += newlines
+                new_pos += len(text)
+            else:
+                old_pos += len(text)
+                new_pos += len("".join(new_lines[new_line - 1:new_line - 1 + newlines]))
+                old_line += newlines
+                new_line += newlines
+            
+            prev_op = op
         
         return blocks
     
-    def generate_diff_html(self, old_text: str, new_text: str) -> str:
+    def _compute_diffs(self, old_text: str, new_text: str) -> Tuple[List[Dict[str, Any]], str]:
         """
-        HTML形式の差分表示を生成し、ナビゲーションマーカーを番号バッジに置き換える
+        差分ブロックと差分HTMLをまとめて計算（スレッドで実行する同期処理）
+        行分割は1回だけ行い、両方の計算で共有する
         """
-        differ = difflib.HtmlDiff(wrapcolumn=80)
-        html = differ.make_table(
-            old_text.splitlines(),
-            new_text.splitlines(),
+        old_lines = _split_lines(old_text)
+        new_lines = _split_lines(new_text)
+        return (
+            self.compute_text_diff(old_text, new_text, old_lines=old_lines, new_lines=new_lines),
+            self.generate_diff_html(old_text, new_text, old_lines=old_lines, new_lines=new_lines)
+        )
+    
+    @staticmethod
+    def _diff_rows(old_lines: List[str], new_lines: List[str]) -> Iterator[str]:
+        """差分表示のHTMLテーブルを行単位で逐次生成（行は_split_linesの改行付きの行）"""
+        # 行内の比較で空白・タブをジャンク扱いしない（charjunk=None、HtmlDiffの既定はIS_CHARACTER_JUNK）
+        # linejunk=Noneは既定と同じ。行の対応付けに使うSequenceMatcherのautojunk
+        # （200行以上の文書で出現頻度1%超の行を無視）はdifflibから変更できないため有効のまま
+        differ = _RowHtmlDiff(wrapcolumn=80, linejunk=None, charjunk=None)
+        return differ.iter_table(
+            old_lines,
+            new_lines,
             fromdesc='旧バージョン',
             todesc='新バージョン',
-            context=True,
             numlines=3
         )
+    
+    def generate_diff_html(
+        self,
+        old_text: str,
+        new_text: str,
+        old_lines: Optional[List[str]] = None,
+        new_lines: Optional[List[str]] = None
+    ) -> str:
+        """
+        HTML形式の差分表示を生成し、変更箇所に番号バッジを付ける
         
-        # <tr>単位で分割して処理
-        rows = re.findall(r'<tr.*?>.*?</tr>', html, re.DOTALL)
-        count = 1
-        processed_rows = []
+        Args:
+            old_lines, new_lines: _split_linesで分割済みの行（省略時はここで分割）
+        """
+        return "".join(self._diff_rows(
+            old_lines if old_lines is not None else _split_lines(old_text),
+            new_lines if new_lines is not None else _split_lines(new_text)
+        ))
+    
+    async def generate_diff_html_stream(
+        self,
+        old_file_content: bytes,
+        new_file_content: bytes,
+        old_filename: str = "old_document",
+        new_filename: str = "new_document"
+    ) -> AsyncIterator[str]:
+        """
+        2つのバージョンの差分HTMLを<tr>単位で逐次生成する
+        （大きな差分でもHTML全体を文字列として組み立てずにクライアントへ送信できる）
+        内容が同一の場合はcompare_versionsと同様に空の差分を返す
+        """
+        if old_file_content == new_file_content:
+            return
         
-        for row in rows:
-            # 変更が含まれる行（diff_add, diff_sub, diff_chg）かどうかを確認
-            is_change_row = 'class="diff_add"' in row or 'class="diff_sub"' in row or 'class="diff_chg"' in row
-            
-            # ナビゲーションリンク (f, n, p, t) を探す
-            if is_change_row and re.search(r'>(f|n|p|t)</a>', row):
-                # 変更行のマーカーを番号付きバッジに置換
-                badge_html = f'><span style="background-color: #4f46e5; color: white; border-radius: 50%; width: 18px; height: 18px; display: inline-flex; align-items: center; justify-content: center; font-size: 10px; font-weight: bold; margin: 0 2px;">{count}</span></a>'
-                row = re.sub(r'>(f|n|p|t)</a>', badge_html, row)
-                count += 1
-            elif re.search(r'>(f|n|p|t)</a>', row):
-                # 変更ではない行にあるナビゲーションマーカー（先頭ジャンプなど）は非表示にする
-                row = re.sub(r'>(f|n|p|t)</a>', '></a>', row)
-                
-            processed_rows.append(row)
-            
-        # 再構築（theadやcolgroupなどは維持し、tbodyの中身を差し替え）
-        # 面倒なので全置換された行リストで再結合するが、make_tableの返り値全体に対して行う
-        # findallで取得した全trを順番に置換していく
-        result_html = html
-        for original, processed in zip(rows, processed_rows):
-            if original != processed:
-                result_html = result_html.replace(original, processed, 1)
-                
-        return result_html
+        old_text, new_text = await asyncio.gather(
+            contract_parser.extract_text_from_file(old_file_content, old_filename),
+            contract_parser.extract_text_from_file(new_file_content, new_filename)
+        )
+        if old_text == new_text:
+            return
+        
+        # 差分計算はCPU処理のため、一定行数ずつスレッドで生成して送信する
+        rows = self._diff_rows(_split_lines(old_text), _split_lines(new_text))
+        while True:
+            chunk = await asyncio.to_thread(_take_rows, rows, DIFF_STREAM_CHUNK_ROWS)
+            if not chunk:
+                break
+            yield chunk
+    
+    @staticmethod
+    def _parse_json_response(content: str) -> Dict[str, Any]:
+        """AI応答をJSONとして解析（JSON以外の文字を含む場合は最外の {...} 部分を解析）"""
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            match = _JSON_BLOCK_RE.search(content)
+            if match is None:
+                raise
+            return orjson.loads(match.group(0))
+    
+    def _prepare_analysis(
+        self,
+        old_text: str,
+        new_text: str,
+        changes: List[Dict[str, Any]]
+    ) -> Tuple[str, List[Any]]:
+        """
+        AI解析用のキャッシュキーとプロンプトを作成
+        
+        Returns:
+            (キャッシュキー, LLMに渡すメッセージ)
+        """
+        # 変更内容を文字列化
+        listed_changes = changes[:50]  # 最大50件に制限
+        # 置換ブロックは削除行と追加行の両方を出力する
+        changes_summary = "\n".join(
+            f"- {label}: {text.rstrip()}"
+            for c in listed_changes
+            for label, text in (("削除", c.get('old_text')), ("追加", c.get('new_text')))
+            if text
+        )
+        
+        # 変更箇所の前後のみを抜粋（文字数制限内で末尾付近の変更も含める）
+        old_excerpt = _windowed_excerpt(old_text, [c['old_range'] for c in listed_changes if 'old_range' in c])
+        new_excerpt = _windowed_excerpt(new_text, [c['new_range'] for c in listed_changes if 'new_range' in c])
+        
+        cache_key = "redline:" + hashlib.sha256("\x00".join([
+            self.llm.model_name, ANALYSIS_PROMPT_VERSION, old_excerpt, new_excerpt, changes_summary
+        ]).encode("utf-8")).hexdigest()
+        
+        formatted_prompt = self._analysis_prompt.format_messages(
+            changes=changes_summary,
+            old_text=old_excerpt,
+            new_text=new_excerpt
+        )
+        return cache_key, formatted_prompt
+    
+    @staticmethod
+    def _failed_analysis() -> Dict[str, Any]:
+        """AI解析に失敗した場合の結果"""
+        return {
+            "summary": "AI解析に失敗しました。手動で確認してください。",
+            "changes": [],
+            "overall_risk": "medium",
+            "overall_summary": "AI解析エラー",
+            "recommendations": ["手動での確認を推奨します"]
+        }
     
     async def analyze_changes_with_ai(
         self, 
@@ -145,112 +548,40 @@ class RedlineService:
         Returns:
             AI解析結果（リスク評価、提案など）
         """
-        # 変更内容を文字列化
-        changes_summary = "\n".join([
-            f"- {'削除' if c['type'] == 'delete' else '追加'}: {c.get('old_text') or c.get('new_text')}"
-            for c in changes[:50]  # 最大50件に制限
-        ])
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """あなたは法務専門のAIアシスタントです。契約書の変更点を分析し、リスク評価を行います。
-            
-            以下の形式でJSON形式の出力を生成してください：
-            
-            {{
-            "summary": "変更内容の要約（日本語、2-3文）",
-            "changes": [
-                {{
-                    "index": 1,
-                    "description": "変更内容の説明",
-                    "change_type": "modify/add/delete",
-                    "risk_level": "high/medium/low",
-                    "risk_reason": "リスク判定の理由",
-                    "recommendation": "対応の提案"
-                }}
-            ],
-            "overall_risk": "high/medium/low",
-            "overall_summary": "全体的なリスク評価のサマリー",
-            "recommendations": ["提案1", "提案2"]
-            }}
-
-            リスク判定基準：
-            - high（高）: 支払条件、責任制限、契約解除、損害賠償に関する重大な変更
-            - medium（中）: 期限、通知義務、秘密保持に関する変更
-            - low（低）: 軽微な文言修正、形式的な変更"""),
-            ("human", """以下の契約書の変更点を分析してください。
-            
-            【変更箇所一覧】
-            {changes}
-            
-            【旧バージョン全文（抜粋）】
-            {old_text}
-
-            【新バージョン全文（抜粋）】
-            {new_text}
-
-            上記の変更について、法務観点からのリスク評価と提案をJSON形式で出力してください。""")
-        ])
+        cache_key, formatted_prompt = self._prepare_analysis(old_text, new_text, changes)
         
-        formatted_prompt = prompt.format_messages(
-            changes=changes_summary,
-            old_text=old_text[:5000],  # 文字数制限
-            new_text=new_text[:5000]
-        )
+        # 同一入力の解析結果が残っていればLLMを呼び出さずに返す
+        cached = self._analysis_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         try:
             response = await self.llm.ainvoke(formatted_prompt)
-            content = response.content
-            
-            # JSON部分を抽出
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0]
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0]
-            
-            result = json.loads(content)
+            result = self._parse_json_response(response.content)
+            self._analysis_cache[cache_key] = result
             return result
             
         except Exception as e:
             print(f"❌ AI analysis failed: {e}")
-            return {
-                "summary": "AI解析に失敗しました。手動で確認してください。",
-                "changes": [],
-                "overall_risk": "medium",
-                "overall_summary": "AI解析エラー",
-                "recommendations": ["手動での確認を推奨します"]
-            }
+            return self._failed_analysis()
     
-    async def compare_versions(
-        self,
-        old_file_content: bytes,
-        new_file_content: bytes,
+    @staticmethod
+    def _unchanged_result(old_version_id: str, new_version_id: str) -> RedlineResult:
+        """内容が同一のバージョン間の比較結果（変更なし）"""
+        return RedlineResult(
+            old_version_id=old_version_id,
+            new_version_id=new_version_id,
+            summary="変更はありません"
+        )
+    
+    @staticmethod
+    def _build_result(
         old_version_id: str,
         new_version_id: str,
-        old_filename: str = "old_document",
-        new_filename: str = "new_document"
+        ai_analysis: Dict[str, Any],
+        diff_html: str
     ) -> RedlineResult:
-        """
-        2つのバージョンを比較し、差分とAI分析を返す
-        """
-        # 1. ファイルからテキスト抽出
-        print(f"📄 Extracting text from old version ({old_filename})...")
-        old_text = await contract_parser.extract_text_from_file(old_file_content, old_filename)
-        
-        print(f"📄 Extracting text from new version ({new_filename})...")
-        new_text = await contract_parser.extract_text_from_file(new_file_content, new_filename)
-        
-        # 2. 差分計算
-        print(f"🔍 Computing differences...")
-        raw_changes = self.compute_text_diff(old_text, new_text)
-        
-        # 3. HTML形式の差分生成
-        diff_html = self.generate_diff_html(old_text, new_text)
-        
-        # 4. AI解析
-        print(f"🤖 Analyzing changes with AI...")
-        ai_analysis = await self.analyze_changes_with_ai(old_text, new_text, raw_changes)
-        
-        # 5. 結果の構築
+        """AI解析結果と差分HTMLから比較結果を構築"""
         changes = []
         ai_changes = ai_analysis.get("changes", [])
         
@@ -267,20 +598,18 @@ class RedlineService:
                 recommendation=ai_change.get("recommendation", "")
             ))
         
-        # リスクカウント
-        high_count = sum(1 for c in changes if c.risk_level == "high")
-        medium_count = sum(1 for c in changes if c.risk_level == "medium")
-        low_count = sum(1 for c in changes if c.risk_level == "low")
+        # リスクカウント（1回の走査で集計）
+        risk_counts = Counter(c.risk_level for c in changes)
         
         risk_assessment = RiskAssessment(
-            high_risk_count=high_count,
-            medium_risk_count=medium_count,
-            low_risk_count=low_count,
+            high_risk_count=risk_counts["high"],
+            medium_risk_count=risk_counts["medium"],
+            low_risk_count=risk_counts["low"],
             overall_risk=ai_analysis.get("overall_risk", "low"),
             summary=ai_analysis.get("overall_summary", "")
         )
         
-        result = RedlineResult(
+        return RedlineResult(
             old_version_id=old_version_id,
             new_version_id=new_version_id,
             changes=changes,
@@ -289,8 +618,141 @@ class RedlineService:
             recommendations=ai_analysis.get("recommendations", []),
             diff_html=diff_html
         )
+    
+    async def compare_versions(
+        self,
+        old_file_content: bytes,
+        new_file_content: bytes,
+        old_version_id: str,
+        new_version_id: str,
+        old_filename: str = "old_document",
+        new_filename: str = "new_document"
+    ) -> RedlineResult:
+        """
+        2つのバージョンを比較し、差分とAI分析を返す
+        """
+        # 同一ファイルの再アップロードは抽出・差分計算・AI解析を省略
+        if old_file_content == new_file_content:
+            print("✅ Files are identical, skipping diff")
+            return self._unchanged_result(old_version_id, new_version_id)
+        
+        # 1. ファイルからテキスト抽出（新旧を並行して実行）
+        print(f"📄 Extracting text from {old_filename} and {new_filename}...")
+        old_text, new_text = await asyncio.gather(
+            contract_parser.extract_text_from_file(old_file_content, old_filename),
+            contract_parser.extract_text_from_file(new_file_content, new_filename)
+        )
+        
+        # ファイルが異なっても抽出テキストが同一なら変更なし
+        if old_text == new_text:
+            print("✅ Extracted texts are identical, skipping diff")
+            return self._unchanged_result(old_version_id, new_version_id)
+        
+        # 2〜3. 差分計算とHTML形式の差分生成（CPU処理のためスレッドで実行）
+        print(f"🔍 Computing differences...")
+        raw_changes, diff_html = await asyncio.to_thread(self._compute_diffs, old_text, new_text)
+        
+        # 4. AI解析
+        print(f"🤖 Analyzing changes with AI...")
+        ai_analysis = await self.analyze_changes_with_ai(old_text, new_text, raw_changes)
+        
+        # 5. 結果の構築
+        return self._build_result(old_version_id, new_version_id, ai_analysis, diff_html)
+    
+    async def compare_versions_batch(self, pairs: List[Dict[str, Any]]) -> List[RedlineResult]:
+        """
+        複数のバージョン組をまとめて比較（AI解析は1回のバッチ呼び出しで並行実行）
+        
+        Args:
+            pairs: compare_versionsと同じキーワード引数の辞書のリスト
+            
+        Returns:
+            入力と同じ順序の比較結果リスト
+        """
+        results: List[Optional[RedlineResult]] = [None] * len(pairs)
+        
+        # 1. テキスト抽出（同一ファイルの組を除き、全ファイルを並行して実行）
+        targets = []
+        for i, pair in enumerate(pairs):
+            if pair["old_file_content"] == pair["new_file_content"]:
+                results[i] = self._unchanged_result(pair["old_version_id"], pair["new_version_id"])
+            else:
+                targets.append(i)
+        
+        texts = await asyncio.gather(*(
+            contract_parser.extract_text_from_file(
+                pairs[i][f"{side}_file_content"], pairs[i].get(f"{side}_filename", f"{side}_document")
+            )
+            for i in targets
+            for side in ("old", "new")
+        ))
         
-        return result
+        # 2. 差分計算（CPU処理のため組ごとにスレッドで並行実行）
+        changed = {}  # 組の番号 -> (旧テキスト, 新テキスト)
+        for n, i in enumerate(targets):
+            old_text, new_text = texts[2 * n], texts[2 * n + 1]
+            if old_text == new_text:
+                pair = pairs[i]
+                results[i] = self._unchanged_result(pair["old_version_id"], pair["new_version_id"])
+            else:
+                changed[i] = (old_text, new_text)
+        
+        diffs = await asyncio.gather(*(
+            asyncio.to_thread(self._compute_diffs, old_text, new_text)
+            for old_text, new_text in changed.values()
+        ))
+        
+        # プロンプト作成（キャッシュ済みの組はAI解析を省略）
+        prepared = {}  # 組の番号 -> (キャッシュキー, 差分HTML)
+        analyses: Dict[int, Dict[str, Any]] = {}
+        pending = []  # AI解析が必要な組の番号
+        prompts = []
+        for (i, (old_text, new_text)), (raw_changes, diff_html) in zip(changed.items(), diffs):
+            cache_key, formatted_prompt = self._prepare_analysis(old_text, new_text, raw_changes)
+            prepared[i] = (cache_key, diff_html)
+            
+            cached = self._analysis_cache.get(cache_key)
+            if cached is not None:
+                analyses[i] = cached
+            else:
+                pending.append(i)
+                prompts.append(formatted_prompt)
+        
+        # 3. AI解析（同時実行数を制限して並行実行）
+        if prompts:
+            print(f"🤖 Analyzing {len(prompts)} version pairs with AI...")
+            responses = await self.llm.abatch(
+                prompts,
+                config={"max_concurrency": REDLINE_BATCH_MAX_CONCURRENCY},
+                return_exceptions=True
+            )
+            for i, response in zip(pending, responses):
+                try:
+                    if isinstance(response, Exception):
+                        raise response
+                    analysis = self._parse_json_response(response.content)
+                    self._analysis_cache[prepared[i][0]] = analysis
+                except Exception as e:
+                    print(f"❌ AI analysis failed: {e}")
+                    analysis = self._failed_analysis()
+                analyses[i] = analysis
+        
+        # 4. 結果の構築
+        for i, (_, diff_html) in prepared.items():
+            pair = pairs[i]
+            results[i] = self._build_result(
+                pair["old_version_id"], pair["new_version_id"], analyses[i], diff_html
+            )
+        
+        return results
+    
+    async def close(self) -> None:
+        """共有HTTPクライアントの接続を閉じる（アプリケーション終了時に呼び出す、次の使用時に作り直される）"""
+        global _http_client, _llm
+        if _http_client is not None:
+            await _http_client.aclose()
+        _http_client = None
+        _llm = None
 
 
 # シングルトンインスタンス
@@ -2,14 +2,55 @@
 LexFlow Protocol - Signature Service
 EIP-712 Signature Verification and Hashing
 """
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Tuple, BinaryIO
 from eth_account import Account
 from eth_account.messages import encode_typed_data
 import hashlib
+import importlib.metadata
 import time
+from functools import lru_cache
 from web3 import Web3
 
 from app.core.config import settings
+from app.core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# 使用中のeth-accountのバージョン（署名検証の不具合調査用にインポート時に1回だけ記録）
+try:
+    logger.debug(f"eth-account version: {importlib.metadata.version('eth-account')}")
+except importlib.metadata.PackageNotFoundError:
+    logger.debug("Could not determine eth-account version")
+
+# EIP-712のデータ型定義（ドメイン + ContractVersion型）
+_EIP712_DOMAIN_TYPE = [
+    {"name": "name", "type": "string"},
+    {"name": "version", "type": "string"},
+    {"name": "chainId", "type": "uint256"},
+    {"name": "verifyingContract", "type": "address"},
+]
+_CONTRACT_VERSION_TYPE = [
+    {"name": "caseId", "type": "string"},
+    {"name": "version", "type": "uint256"},
+    {"name": "docHash", "type": "bytes32"},
+    {"name": "timestamp", "type": "uint256"}
+]
+
+
+@lru_cache(maxsize=32)
+def _signing_domain(chain_id: int, contract_addr: str) -> Dict[str, Any]:
+    """EIP-712ドメイン定義を作成（チェックサム計算を含むため結果をキャッシュ）"""
+    # verifyingContractが空の場合は0アドレスを使用
+    if not contract_addr:
+        contract_addr = "0x0000000000000000000000000000000000000000"
+        
+    return {
+        "name": "LexFlow Protocol",
+        "version": "1",
+        "chainId": chain_id,
+        "verifyingContract": Web3.to_checksum_address(contract_addr)
+    }
+
 
 class SignatureService:
     """
@@ -22,38 +63,29 @@ class SignatureService:
         デフォルトは Sepolia (11155111)
         """
         # settingsから取得する際も int にキャストして安全性を高める
-        final_chain_id = int(chain_id)
-        
-        # verifyingContractが空の場合は0アドレスを使用
-        contract_addr = settings.ESCROW_CONTRACT_ADDRESS
-        if not contract_addr or contract_addr == "":
-            contract_addr = "0x0000000000000000000000000000000000000000"
-            
-        return {
-            "name": "LexFlow Protocol",
-            "version": "1",
-            "chainId": final_chain_id,
-            "verifyingContract": Web3.to_checksum_address(contract_addr)
-        }
+        # キャッシュ済みの定義を共有するため、呼び出し側で変更できるようコピーを返す
+        return dict(_signing_domain(int(chain_id), settings.ESCROW_CONTRACT_ADDRESS))
 
     def get_version_types(self) -> Dict[str, Any]:
         """
         EIP-712のデータ型定義 (ContractVersion型)
         """
-        return {
-            "ContractVersion": [
-                {"name": "caseId", "type": "string"},
-                {"name": "version", "type": "uint256"},
-                {"name": "docHash", "type": "bytes32"},
-                {"name": "timestamp", "type": "uint256"}
-            ]
-        }
+        return {"ContractVersion": _CONTRACT_VERSION_TYPE}
 
     def calculate_doc_hash(self, file_content: bytes) -> str:
         """
         ファイルのSHA-256ハッシュを計算する (0xプレフィックス付き)
         """
-        sha256_hash = hashlib.sha256(file_content).hexdigest()
+        # memoryview経由でバッファを直接渡し、スライス等によるコピーを発生させない
+        sha256_hash = hashlib.sha256(memoryview(file_content)).hexdigest()
+        return f"0x{sha256_hash}"
+
+    def calculate_doc_hash_stream(self, fp: BinaryIO) -> str:
+        """
+        ファイルオブジェクトのSHA-256ハッシュを計算する (0xプレフィックス付き)
+        ディスク上のファイルを read() で全て読み込まずにハッシュ化する
+        """
+        sha256_hash = hashlib.file_digest(fp, "sha256").hexdigest()
         return f"0x{sha256_hash}"
 
     def verify_eip712_signature(
@@ -78,36 +110,24 @@ class SignatureService:
             clean_doc_hash = str(doc_hash).strip()
             expected_signer = Web3.to_checksum_address(signer_address.strip())
             
-            # docHashのバイト化
-            bytes_doc_hash = clean_doc_hash
-            if clean_doc_hash.startswith("0x"):
-                try:
-                    bytes_doc_hash = bytes.fromhex(clean_doc_hash[2:])
-                except ValueError:
-                    # If conversion fails, keep it as string for now, will be handled by string trial
-                    pass
-
+            # docHashのバイト化（bytes32のため32バイトであること）
             try:
-                import importlib.metadata
-                eth_account_version = importlib.metadata.version("eth-account")
-                print(f"DEBUG: eth-account version: {eth_account_version}")
-            except Exception:
-                print("DEBUG: Could not determine eth-account version")
+                bytes_doc_hash = bytes.fromhex(clean_doc_hash.removeprefix("0x"))
+            except ValueError:
+                bytes_doc_hash = b""
+            if len(bytes_doc_hash) != 32:
+                error_detail = f"Invalid docHash: expected 32-byte hex, got {clean_doc_hash!r}"
+                print(f"❌ {error_detail}")
+                return False, error_detail, None
             
             # 署名データの構築
-            domain = self.get_signing_domain(int(chain_id))
-            types = self.get_version_types()
+            domain = _signing_domain(int(chain_id), settings.ESCROW_CONTRACT_ADDRESS)
             
             def build_structured_data(d_hash_val):
                 return {
                     "types": {
-                        "EIP712Domain": [
-                            {"name": "name", "type": "string"},
-                            {"name": "version", "type": "string"},
-                            {"name": "chainId", "type": "uint256"},
-                            {"name": "verifyingContract", "type": "address"},
-                        ],
-                        **types
+                        "EIP712Domain": _EIP712_DOMAIN_TYPE,
+                        "ContractVersion": _CONTRACT_VERSION_TYPE
                     },
                     "domain": domain,
                     "primaryType": "ContractVersion",
@@ -119,34 +139,32 @@ class SignatureService:
                     }
                 }
 
-            import json
-            # 試行1: Bytes docHash
-            try:
-                sd1 = build_structured_data(bytes_doc_hash)
-                encoded1 = encode_typed_data(full_message=sd1)
-                recovered1 = Account.recover_message(encoded1, signature=signature)
-                if Web3.to_checksum_address(recovered1) == expected_signer:
-                    return True, "", recovered1
-            except Exception as e:
-                recovered1 = f"Error: {str(e)}"
-
-            # 試行2: String docHash
-            try:
-                sd2 = build_structured_data(clean_doc_hash)
-                encoded2 = encode_typed_data(full_message=sd2)
-                recovered2 = Account.recover_message(encoded2, signature=signature)
-                if Web3.to_checksum_address(recovered2) == expected_signer:
-                    return True, "", recovered2
-            except Exception as e:
-                recovered2 = f"Error: {str(e)}"
-
-            # いずれも失敗した場合は詳細を返す
+            # bytes32のdocHashで1回だけエンコードして署名者を復元
+            encoded = encode_typed_data(full_message=build_structured_data(bytes_doc_hash))
+            recovered = Account.recover_message(encoded, signature=signature)
+            if Web3.to_checksum_address(recovered) == expected_signer:
+                return True, "", recovered
+
+            # デバッグモードのみ: 文字列のdocHashで署名したクライアントの調査用に再試行
+            recovered_hex = None
+            if settings.DEBUG:
+                try:
+                    encoded_hex = encode_typed_data(full_message=build_structured_data(clean_doc_hash))
+                    recovered_hex = Account.recover_message(encoded_hex, signature=signature)
+                    if Web3.to_checksum_address(recovered_hex) == expected_signer:
+                        return True, "", recovered_hex
+                except Exception as e:
+                    recovered_hex = f"Error: {str(e)}"
+
+            # 一致しない場合は詳細を返す
             error_detail = (
                 f"Recovered address mismatch. Expected: {expected_signer}, "
-                f"Recovered(bytes): {recovered1}, Recovered(hex): {recovered2}. "
+                f"Recovered: {recovered}. "
             )
+            if recovered_hex is not None:
+                error_detail += f"Recovered(hex): {recovered_hex}. "
             print(f"❌ {error_detail}")
-            return False, error_detail, recovered1
+            return False, error_detail, recovered
             
         except Exception as e:
             error_msg = f"Signature verification logic error: {str(e)}"
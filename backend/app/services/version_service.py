@@ -4,14 +4,33 @@ Contract Version Management and File Handling
 """
 import os
 import uuid
+import asyncio
 import json
+from pathlib import Path
 from typing import List, Optional, Dict, Any
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
+from sqlalchemy import select, desc, func
 from datetime import datetime
 
 from app.models.models import ContractVersion, VersionStatus, Contract
 from app.services.signature_service import signature_service
+from app.core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# 拡張子が判定できない場合の既定値
+_DEFAULT_EXT = ".pdf"
+
+
+def _file_extension(filename: str) -> str:
+    """
+    ファイル名から小文字の拡張子を取得
+    ファイル名自体が拡張子のみの場合（例: .txt）はそれを拡張子とみなす
+    """
+    name = Path(filename).name
+    suffix = Path(name).suffix or (name if name.startswith(".") else "")
+    return suffix.lower() or _DEFAULT_EXT
+
 
 class VersionService:
     """
@@ -40,37 +59,26 @@ class VersionService:
         
         # 2. 最新のバージョン番号を取得
         current_max = await db.execute(
-            select(ContractVersion.version)
+            select(func.coalesce(func.max(ContractVersion.version), 0))
             .where(ContractVersion.case_id == case_id)
-            .order_by(desc(ContractVersion.version))
-            .limit(1)
         )
-        last_version = current_max.scalar_one_or_none() or 0
+        last_version = current_max.scalar_one()
         new_version_num = last_version + 1
         
         # 3. ファイル保存
         # 保存先ディレクトリの作成
         upload_dir = "uploads/versions"
-        if not os.path.exists(upload_dir):
-            os.makedirs(upload_dir)
+        os.makedirs(upload_dir, exist_ok=True)
             
         # 拡張子の決定
-        print(f"📁 Version file saving: received filename='{filename}'")
-        original_ext = os.path.splitext(filename)[1].lower()
-        if not original_ext:
-            # ファイル名自体が拡張子のみの場合（例: .txt）
-            if filename.startswith('.'):
-                original_ext = filename.lower()
-            else:
-                original_ext = ".pdf" # Default
-        
-        print(f"🔧 Determined extension: '{original_ext}'")
+        original_ext = _file_extension(filename)
+        logger.debug(f"📁 Version file saving: filename='{filename}', extension='{original_ext}'")
             
         file_name = f"{case_id}_v{new_version_num}_{uuid.uuid4().hex[:8]}{original_ext}"
         file_path = os.path.join(upload_dir, file_name)
         
-        with open(file_path, "wb") as f:
-            f.write(file_content)
+        # 大きなPDFの書き込みでイベントループを止めないようスレッドで実行
+        await asyncio.to_thread(Path(file_path).write_bytes, file_content)
             
         # 4. 前のバージョンがあれば SUPERSEDED に更新
         if last_version > 0:
@@ -6,13 +6,23 @@ snarkjsで生成された証明をPythonで検証します。
 
 """
 import json
+import asyncio
 import subprocess
-import tempfile
-import os
 from typing import Dict, Any, Optional
 from pathlib import Path
 
 
+# 1件の検証の待ち時間の上限（秒）
+VERIFY_TIMEOUT_SECONDS = 60
+
+# 回路名と検証鍵ファイル（ビルドディレクトリからの相対パス）
+CIRCUIT_VKEYS = {
+    "kyc": "kyc/kyc_verification_verification_key.json",
+    "coi": "coi/conflict_of_interest_verification_key.json",
+    "fulfillment": "fulfillment/fulfillment_status_verification_key.json"
+}
+
+
 class ZKVerifier:
     """ゼロ知識証明検証サービス"""
     
@@ -28,6 +38,23 @@ class ZKVerifier:
         else:
             # プロジェクトの contracts/zk/build ディレクトリをデフォルトにする
             self.circuits_path = Path(__file__).parent.parent.parent.parent / "contracts" / "zk" / "build"
+        
+        # 検証鍵を起動時に1回だけ読み込む（検証ごとのファイル確認・解析を省く）
+        # 起動後にエクスポートした検証鍵を反映するにはアプリケーションの再起動が必要
+        self._vkeys: Dict[str, Dict[str, Any]] = {}
+        for name, relative_path in CIRCUIT_VKEYS.items():
+            vkey_path = self.circuits_path / relative_path
+            if not vkey_path.exists():
+                continue
+            try:
+                self._vkeys[name] = json.loads(vkey_path.read_bytes())
+            except (OSError, ValueError) as e:
+                print(f"⚠️ 検証鍵の読み込みに失敗: {vkey_path}: {e}")
+        
+        # 常駐型の検証ワーカー（contracts/zk/scripts/verifier_server.js、初回の検証時に起動）
+        self._worker: Optional[asyncio.subprocess.Process] = None
+        self._worker_lock = asyncio.Lock()
+        self._request_id = 0
     
     async def verify_kyc_proof(
         self,
@@ -47,8 +74,7 @@ class ZKVerifier:
         return await self._verify_proof(
             proof=proof,
             public_signals=public_signals,
-            circuit_name="kyc",
-            vkey_file="kyc_verification_verification_key.json"
+            circuit_name="kyc"
         )
     
     async def verify_coi_proof(
@@ -69,8 +95,7 @@ class ZKVerifier:
         return await self._verify_proof(
             proof=proof,
             public_signals=public_signals,
-            circuit_name="coi",
-            vkey_file="conflict_of_interest_verification_key.json"
+            circuit_name="coi"
         )
     
     async def verify_fulfillment_proof(
@@ -91,69 +116,137 @@ class ZKVerifier:
         return await self._verify_proof(
             proof=proof,
             public_signals=public_signals,
-            circuit_name="fulfillment",
-            vkey_file="fulfillment_status_verification_key.json"
+            circuit_name="fulfillment"
         )
     
     async def _verify_proof(
         self,
         proof: Dict[str, Any],
         public_signals: list,
-        circuit_name: str,
-        vkey_file: str
+        circuit_name: str
     ) -> tuple[bool, Optional[str]]:
         """
-        内部メソッド。snarkjs CLIを使用して任意のZK証明を検証
+        内部メソッド。snarkjsを使用して任意のZK証明を検証
         
         Groth16証明の純粋なPython検証は複雑な楕円曲線操作を必要とするため、
-        CLIアプローチを使用します。
+        常駐Nodeワーカーで検証します（ワーカーが異常終了した場合は1回限りの起動にフォールバック）。
         """
-        vkey_path = self.circuits_path / circuit_name / vkey_file
+        vkey_path = self.circuits_path / CIRCUIT_VKEYS[circuit_name]
+        vkey = self._vkeys.get(circuit_name)
         
-        if not vkey_path.exists():
+        if vkey is None:
             return False, f"検証鍵が見つかりません: {vkey_path}"
         
         try:
-            # 証明と公開信号の一時ファイルを作成
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as proof_file:
-                json.dump(proof, proof_file)
-                proof_path = proof_file.name
-            
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as signals_file:
-                json.dump(public_signals, signals_file)
-                signals_path = signals_file.name
-            
-            # snarkjsのパスを取得（contracts/zk/node_modules/.bin/snarkjs）
-            snarkjs_path = self.circuits_path.parent / "node_modules" / ".bin" / "snarkjs"
-            
-            # snarkjs verifyコマンドを実行
-            # npxを使わずに直接実行することでオーバーヘッドを削減
-            cmd = [
-                str(snarkjs_path), 'groth16', 'verify',
-                str(vkey_path),
-                signals_path,
-                proof_path
-            ]
-            
-            # もしバイナリが見つからない場合はフォールバックとしてnpxを使う
-            if not snarkjs_path.exists():
-                cmd = ['npx', 'snarkjs', 'groth16', 'verify', str(vkey_path), signals_path, proof_path]
-
+            return await self._verify_with_worker(vkey_path, proof, public_signals)
+        except asyncio.TimeoutError:
+            await self._stop_worker()
+            return False, "検証タイムアウト"
+        except (OSError, RuntimeError, ValueError) as e:
+            # ワーカーが起動できない・異常終了した場合などは1回限りの起動で検証
+            print(f"⚠️ ZK verifier worker unavailable, falling back to one-shot verification: {e}")
+            await self._stop_worker()
+            return await asyncio.to_thread(self._verify_once, vkey, proof, public_signals)
+    
+    async def _verify_with_worker(
+        self,
+        vkey_path: Path,
+        proof: Dict[str, Any],
+        public_signals: list
+    ) -> tuple[bool, Optional[str]]:
+        """常駐ワーカーに1件の検証を依頼（ワーカーとのやり取りは1件ずつ直列化）"""
+        async with self._worker_lock:
+            worker = await self._ensure_worker()
+            self._request_id += 1
+            request = {
+                "id": self._request_id,
+                "vkey_path": str(vkey_path),
+                "proof": proof,
+                "signals": public_signals
+            }
+            worker.stdin.write(json.dumps(request).encode("utf-8") + b"\n")
+            await worker.stdin.drain()
+            line = await asyncio.wait_for(worker.stdout.readline(), timeout=VERIFY_TIMEOUT_SECONDS)
+        
+        if not line:
+            raise RuntimeError("検証ワーカーが終了しました")
+        
+        response = json.loads(line)
+        if response.get("id") != request["id"]:
+            raise RuntimeError("検証ワーカーの応答が一致しません")
+        if response.get("ok"):
+            return True, None
+        return False, response.get("error") or "検証失敗"
+    
+    async def _ensure_worker(self) -> asyncio.subprocess.Process:
+        """検証ワーカーが起動していなければ起動する"""
+        if self._worker is None or self._worker.returncode is not None:
+            zk_dir = self.circuits_path.parent
+            self._worker = await asyncio.create_subprocess_exec(
+                "node", str(zk_dir / "scripts" / "verifier_server.js"),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                cwd=str(zk_dir)  # snarkjsをcontracts/zk/node_modulesから読み込む
+            )
+        return self._worker
+    
+    async def _stop_worker(self):
+        """検証ワーカーを停止（次回の検証時に再起動される）"""
+        worker, self._worker = self._worker, None
+        if worker is None or worker.returncode is not None:
+            return
+        worker.kill()
+        await worker.wait()
+    
+    async def close(self):
+        """アプリケーション終了時に検証ワーカーを終了させる"""
+        worker, self._worker = self._worker, None
+        if worker is None or worker.returncode is not None:
+            return
+        # 標準入力を閉じるとワーカーは自ら終了する
+        worker.stdin.close()
+        try:
+            await asyncio.wait_for(worker.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            worker.kill()
+            await worker.wait()
+    
+    def _verify_once(
+        self,
+        vkey: Dict[str, Any],
+        proof: Dict[str, Any],
+        public_signals: list
+    ) -> tuple[bool, Optional[str]]:
+        """
+        検証ワーカーを1回だけ起動して検証（常駐ワーカーを使えない場合のフォールバック）
+        
+        証明と公開信号は標準入力で渡すため、一時ファイルは作成しない
+        """
+        zk_dir = self.circuits_path.parent
+        request = json.dumps({
+            "id": 0,
+            "vkey": vkey,  # 読み込み済みの検証鍵を渡し、ワーカー側でのファイル読み込みを省く
+            "proof": proof,
+            "signals": public_signals
+        })
+        
+        try:
             result = subprocess.run(
-                cmd,
+                ["node", str(zk_dir / "scripts" / "verifier_server.js")],
+                input=request + "\n",
                 capture_output=True,
                 text=True,
-                timeout=60
+                timeout=VERIFY_TIMEOUT_SECONDS,
+                cwd=str(zk_dir)
             )
             
-            # 一時ファイルを削除
-            os.unlink(proof_path)
-            os.unlink(signals_path)
-            
-            if result.returncode == 0 and "OK" in result.stdout:
-                return True, None
-            else:
-                return False, result.stderr or "検証失敗"
+            lines = result.stdout.strip().splitlines()
+            if result.returncode == 0 and lines:
+                response = json.loads(lines[-1])
+                if response.get("ok"):
+                    return True, None
+                return False, response.get("error") or "検証失敗"
+            return False, result.stderr or "検証失敗"
                 
         except subprocess.TimeoutExpired:
             return False, "検証タイムアウト"
@@ -167,18 +260,8 @@ class ZKVerifier:
         Returns:
             コンパイルされた回路の状態を辞書で返す
         """
-        circuits = {
-            "kyc": "kyc/kyc_verification_verification_key.json",
-            "coi": "coi/conflict_of_interest_verification_key.json",
-            "fulfillment": "fulfillment/fulfillment_status_verification_key.json"
-        }
-        
-        status = {}
-        for name, path in circuits.items():
-            full_path = self.circuits_path / path
-            status[name] = full_path.exists()
-        
-        return status
+        # 起動時に読み込んだ検証鍵から判定（ファイルシステムは参照しない）
+        return {name: name in self._vkeys for name in CIRCUIT_VKEYS}
 
 
 # シングルトンインスタンス
@@ -0,0 +1,63 @@
+/**
+ * 常駐型の証明検証ワーカー - バックエンドから起動されるGroth16検証プロセス
+ *
+ * このスクリプトは、バックエンド（app/services/zk_verifier.py）から一度だけ起動され、
+ * 標準入力から1行1件のJSONリクエストを受け取り、検証結果を1行のJSONで標準出力に返します。
+ * プロセスを使い回すことで、検証ごとのNode起動コストと一時ファイルの書き込みを省きます。
+ *
+ * リクエスト: {"id": 1, "vkey_path": "...", "proof": {...}, "signals": [...]}
+ *             （"vkey" に検証鍵オブジェクトを直接渡すことも可能）
+ * レスポンス: {"id": 1, "ok": true} / {"id": 1, "ok": false, "error": "..."}
+ */
+
+const snarkjs = require("snarkjs");
+const fs = require("fs");
+const readline = require("readline");
+
+// 検証鍵のキャッシュ（パス -> 検証鍵）
+const vkeys = new Map();
+
+function loadVerificationKey(vkeyPath) {
+    if (!vkeys.has(vkeyPath)) {
+        vkeys.set(vkeyPath, JSON.parse(fs.readFileSync(vkeyPath, "utf8")));
+    }
+    return vkeys.get(vkeyPath);
+}
+
+function respond(response) {
+    process.stdout.write(JSON.stringify(response) + "\n");
+}
+
+async function handleLine(line) {
+    let id = null;
+    try {
+        const request = JSON.parse(line);
+        id = request.id ?? null;
+
+        const vkey = request.vkey ?? loadVerificationKey(request.vkey_path);
+        const ok = await snarkjs.groth16.verify(vkey, request.signals, request.proof);
+        respond(ok ? { id, ok: true } : { id, ok: false, error: "検証失敗" });
+    } catch (error) {
+        respond({ id, ok: false, error: error.message });
+    }
+}
+
+// 処理中の検証（標準入力が閉じられても応答を返し終えてから終了する）
+const pending = new Set();
+
+const rl = readline.createInterface({ input: process.stdin });
+
+rl.on("line", (line) => {
+    if (!line.trim()) {
+        return;
+    }
+    const task = handleLine(line).finally(() => pending.delete(task));
+    pending.add(task);
+});
+
+// バックエンドが標準入力を閉じたら、処理中の検証を終えてから終了
+// （1件分のリクエストを標準入力に渡して1回だけ実行する使い方も可能）
+rl.on("close", async () => {
+    await Promise.all(pending);
+    process.exit(0);
+});